@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the startup time of the command line tools.
+
+Runs each entry point with --help in a fresh interpreter (best of
+several runs) and fails if one of them exceeds the time limit or
+imports one of the heavy modules (matplotlib, numpy, PIL).
+
+Usage (from the repository root or with bsch installed):
+
+    python benchmarks/import_time.py [--limit SECONDS] [--runs N]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("matplotlib", "numpy", "PIL")
+
+ENTRY_POINTS = [
+    "bsch.gtc400c.jpeg:main",
+    "bsch.gtc400c.metadata:main",
+    "bsch.gtc400c.ftp:main",
+    "bsch.gtc400c.catalog:main",
+    "bsch.gtc400c.archive:main",
+    "bsch.gtc400c.batch:main",
+    "bsch.gtc400c.pipeline:main",
+    "bsch.gtc400c.util:cli_plot",
+    "bsch.gtc400c.util:cli_thermogram",
+    "bsch.gtc400c.util:cli_blend",
+]
+
+SCRIPT = """
+import sys
+module, _, func = sys.argv[1].partition(":")
+sys.argv = [module, "--help"]
+try:
+    getattr(__import__(module, fromlist=[func]), func)()
+except SystemExit:
+    pass
+heavy = [m for m in {heavy!r} if m in sys.modules]
+if heavy:
+    sys.exit("imported: " + ", ".join(heavy))
+"""
+
+def startup_time(entry_point, runs):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(heavy=HEAVY_MODULES), entry_point],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        best = min(best, time.perf_counter() - start)
+        if proc.returncode:
+            return best, proc.stderr.strip()
+    return best, None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=float, default=0.15, help="Maximum startup time in seconds (including the interpreter).")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for entry_point in ENTRY_POINTS:
+        duration, error = startup_time(entry_point, args.runs)
+        status = "ok"
+        if error:
+            status, failed = error.splitlines()[-1], True
+        elif duration > args.limit:
+            status, failed = "too slow", True
+        print(f"{entry_point:36s} {duration*1000:7.1f} ms  {status}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
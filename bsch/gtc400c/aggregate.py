@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+Streaming per-pixel statistics over arbitrarily many thermograms with
+constant memory: count, mean, standard deviation (Welford / Chan et al.),
+min, max and a histogram of all pixel values. Aggregators fed by
+different workers can be merged.
+"""
+
+from .fusion import N_ROWS, N_COLS
+
+def raw_frame(item):
+    """ The raw (120, 160) uint16 matrix of a Thermography, a thermoblob or an array """
+    import numpy as np
+    if hasattr(item, "get_matrix_raw"):
+        return item.get_matrix_raw()
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return np.frombuffer(item, dtype="<u2", count=N_ROWS*N_COLS, offset=0x20).reshape((N_ROWS, N_COLS))
+    return np.asarray(item).reshape((N_ROWS, N_COLS))
+
+class PixelAggregator:
+    """
+    Accumulates per-pixel statistics of frames in fixed size buffers.
+    All statistics are kept for the raw values and scaled to deg C on
+    access. The histogram counts every possible raw value (65536 bins,
+    i.e. 0.01 deg C resolution) and can be rebinned with histogram().
+    """
+
+    def __init__(self):
+        import numpy as np
+        self.count = 0
+        self._mean = np.zeros((N_ROWS, N_COLS), dtype=np.float64)
+        self._m2 = np.zeros((N_ROWS, N_COLS), dtype=np.float64)
+        self._min = np.full((N_ROWS, N_COLS), 0xFFFF, dtype=np.uint16)
+        self._max = np.zeros((N_ROWS, N_COLS), dtype=np.uint16)
+        self.counts = np.zeros(0x10000, dtype=np.int64)
+
+    def add(self, item):
+        """ Add a single frame (Thermography, thermoblob or raw array) """
+        self.add_frames(raw_frame(item)[None])
+
+    def add_frames(self, frames):
+        """ Add a batch of raw frames of shape (k, 120, 160) """
+        import numpy as np
+        frames = np.asarray(frames)
+        if not len(frames):
+            return
+        values = frames.astype(np.float64)
+        mean = values.mean(axis=0)
+        values -= mean
+        np.square(values, out=values)
+        self._combine(len(frames), mean, values.sum(axis=0), frames.min(axis=0), frames.max(axis=0))
+        self.counts += np.bincount(frames.ravel(), minlength=0x10000)
+
+    def merge(self, other):
+        """ Merge the statistics of another aggregator into this one """
+        if other.count:
+            self._combine(other.count, other._mean, other._m2, other._min, other._max)
+            self.counts += other.counts
+        return self
+
+    def _combine(self, n_b, mean_b, m2_b, min_b, max_b):
+        import numpy as np
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self._mean
+        self._mean += delta * (n_b / n)
+        self._m2 += m2_b + delta**2 * (n_a * n_b / n)
+        np.minimum(self._min, min_b, out=self._min)
+        np.maximum(self._max, max_b, out=self._max)
+        self.count = n
+
+    @property
+    def mean(self):
+        return (self._mean - 10000) / 100
+
+    def std(self, ddof=0):
+        import numpy as np
+        return np.sqrt(self._m2 / max(self.count - ddof, 1)) / 100
+
+    @property
+    def min(self):
+        return (self._min - 10000.0) / 100
+
+    @property
+    def max(self):
+        return (self._max - 10000.0) / 100
+
+    def histogram(self, bins=100, range=None):
+        """
+        Histogram of all pixel values, like numpy.histogram(): returns
+        (counts, bin_edges) with the edges in deg C.
+        """
+        import numpy as np
+        temps = (np.arange(0x10000) - 10000) / 100
+        if range is None:
+            used = np.flatnonzero(self.counts)
+            range = (temps[used[0]], temps[used[-1]]) if len(used) else (0.0, 1.0)
+        return np.histogram(temps, bins=bins, range=range, weights=self.counts)
+
+def aggregate(items, batch_size=64, aggregator=None):
+    """
+    Feed the items (Thermography objects, thermoblobs or raw arrays) from
+    an iterable into an aggregator, batch_size frames at a time through
+    one reused buffer. Returns the aggregator.
+    """
+    import numpy as np
+    aggregator = aggregator or PixelAggregator()
+    buffer = np.empty((batch_size, N_ROWS, N_COLS), dtype=np.uint16)
+    fill = 0
+    for item in items:
+        buffer[fill] = raw_frame(item)
+        fill += 1
+        if fill == batch_size:
+            aggregator.add_frames(buffer)
+            fill = 0
+    aggregator.add_frames(buffer[:fill])
+    return aggregator
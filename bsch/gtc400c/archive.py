@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""
+A compact archive format for thermogram libraries: only the thermoblobs
+are kept, grouped into zlib-compressed chunks of frames. Optionally, each
+frame is stored as difference to the previous frame of the same chunk.
+An index of the chunks allows reading any frame by decompressing just
+its own chunk.
+
+Layout (all integers little-endian):
+
+* header: magic, version, flags, frames per chunk, number of frames,
+  thermoblob size, offset and length of the index
+* the compressed chunks
+* the index: zlib-compressed JSON with the chunk offsets/lengths and
+  the names of the frames
+"""
+
+import array
+import json
+import os
+import struct
+import sys
+import zlib
+
+from .jpeg import thermoblob_extr_file, InvalidFileError
+from .fusion import Thermography, have_numpy
+
+MAGIC = b"GTCA"
+VERSION = 1
+FLAG_DELTA = 0x1
+
+header = struct.Struct("<4sHHIIIQI")
+# stored as unsigned short in the header
+MAX_CHUNK_SIZE = 0xFFFF
+
+class InvalidArchiveError(Exception):
+    pass
+
+def _words(data):
+    words = array.array("H")
+    words.frombytes(data)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+def _to_bytes(words):
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words.tobytes()
+
+def delta_encode(thermoblob, previous):
+    """ Difference of the thermoblob to the previous one, as 16 bit words modulo 2**16 """
+    return _to_bytes(array.array("H", [(a - b) & 0xFFFF for a, b in zip(_words(thermoblob), _words(previous))]))
+
+def delta_decode(delta, previous):
+    return _to_bytes(array.array("H", [(a + b) & 0xFFFF for a, b in zip(_words(delta), _words(previous))]))
+
+def delta_encode_chunk(thermoblobs):
+    """
+    Encode a chunk: the first thermoblob as is, each following one as
+    difference to its predecessor. Uses NumPy if available.
+    """
+    if not have_numpy():
+        frames = thermoblobs[:1]
+        for previous, thermoblob in zip(thermoblobs, thermoblobs[1:]):
+            frames.append(delta_encode(thermoblob, previous))
+        return b"".join(frames)
+    import numpy as np
+    frames = np.frombuffer(b"".join(thermoblobs), dtype="<u2").reshape((len(thermoblobs), -1))
+    deltas = frames.copy()
+    # uint16 arithmetic wraps around modulo 2**16
+    np.subtract(frames[1:], frames[:-1], out=deltas[1:])
+    return deltas.tobytes()
+
+def delta_decode_chunk(data, blob_size):
+    """ Inverse of delta_encode_chunk(), returns the list of thermoblobs """
+    if not have_numpy():
+        frames = [data[pos:pos+blob_size] for pos in range(0, len(data), blob_size)]
+        for j in range(1, len(frames)):
+            frames[j] = delta_decode(frames[j], frames[j-1])
+        return frames
+    import numpy as np
+    deltas = np.frombuffer(data, dtype="<u2").reshape((-1, blob_size // 2))
+    frames = np.cumsum(deltas, axis=0, dtype=np.uint16).astype("<u2", copy=False).tobytes()
+    return [frames[pos:pos+blob_size] for pos in range(0, len(frames), blob_size)]
+
+class ArchiveWriter:
+
+    def __init__(self, path, chunk_size=16, delta=False, level=6):
+        if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"chunk_size needs to be in the range 1 - {MAX_CHUNK_SIZE}")
+        self.fp = open(path, "wb")
+        self.chunk_size = chunk_size
+        self.delta = delta
+        self.level = level
+        self.blob_size = None
+        self.names = []
+        self.chunks = []
+        self.pending = []
+        self.fp.write(b"\0" * header.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+
+    def add(self, thermoblob, name=""):
+        if self.blob_size is None:
+            if len(thermoblob) % 2:
+                raise ValueError("thermoblobs need to have an even size")
+            self.blob_size = len(thermoblob)
+        elif len(thermoblob) != self.blob_size:
+            raise ValueError(f"all thermoblobs need to have the same size ({self.blob_size} bytes)")
+        self.names.append(name)
+        self.pending.append(bytes(thermoblob))
+        if len(self.pending) == self.chunk_size:
+            self._flush_chunk()
+
+    def add_jpeg(self, jpeg_file):
+        """ Add the thermoblob of a JPEG file (path or binary file object) """
+        name = os.path.basename(getattr(jpeg_file, "name", jpeg_file))
+        self.add(thermoblob_extr_file(jpeg_file), name=name)
+
+    def _flush_chunk(self):
+        if not self.pending:
+            return
+        frames = delta_encode_chunk(self.pending) if self.delta else b"".join(self.pending)
+        data = zlib.compress(frames, self.level)
+        self.chunks.append((self.fp.tell(), len(data)))
+        self.fp.write(data)
+        self.pending = []
+
+    def close(self):
+        self._flush_chunk()
+        index = zlib.compress(json.dumps({"chunks": self.chunks, "names": self.names}).encode("utf-8"))
+        index_offset = self.fp.tell()
+        self.fp.write(index)
+        self.fp.seek(0)
+        self.fp.write(header.pack(
+            MAGIC, VERSION, FLAG_DELTA if self.delta else 0, self.chunk_size,
+            len(self.names), self.blob_size or 0, index_offset, len(index),
+        ))
+        self.fp.close()
+
+class ArchiveReader:
+    """
+    Random access to the frames of an archive: reader[i] is the thermoblob
+    of frame i, reader.thermography(i) a Thermography without the JPEG.
+    """
+
+    def __init__(self, path):
+        self.fp = open(path, "rb")
+        magic, version, flags, self.chunk_size, self.n_frames, self.blob_size, index_offset, index_length = \
+            header.unpack(self.fp.read(header.size))
+        if magic != MAGIC or version != VERSION:
+            raise InvalidArchiveError(f"{path} is no thermoblob archive (version {VERSION})")
+        if not self.chunk_size:
+            raise InvalidArchiveError(f"{path} has an invalid chunk size of 0")
+        self.delta = bool(flags & FLAG_DELTA)
+        self.fp.seek(index_offset)
+        index = json.loads(zlib.decompress(self.fp.read(index_length)))
+        self.chunks = index["chunks"]
+        self.names = index["names"]
+        self._cached_chunk = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+
+    def __len__(self):
+        return self.n_frames
+
+    def _chunk(self, i):
+        """ The decoded thermoblobs of chunk i, the last one is cached """
+        if self._cached_chunk[0] == i:
+            return self._cached_chunk[1]
+        offset, length = self.chunks[i]
+        self.fp.seek(offset)
+        data = zlib.decompress(self.fp.read(length))
+        size = self.blob_size
+        if self.delta:
+            frames = delta_decode_chunk(data, size)
+        else:
+            frames = [data[pos:pos+size] for pos in range(0, len(data), size)]
+        self._cached_chunk = i, frames
+        return frames
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n_frames
+        if not 0 <= i < self.n_frames:
+            raise IndexError("frame index out of range")
+        return self._chunk(i // self.chunk_size)[i % self.chunk_size]
+
+    def __iter__(self):
+        for i in range(self.n_frames):
+            yield self[i]
+
+    def thermography(self, i):
+        return Thermography.from_thermoblob(self[i])
+
+def create_archive(path, jpeg_files, chunk_size=16, delta=False, verbose=False):
+    """ Convert the JPEG files (paths) to an archive, skipping files without thermoblob """
+    with ArchiveWriter(path, chunk_size=chunk_size, delta=delta) as writer:
+        for jpeg_file in jpeg_files:
+            try:
+                writer.add_jpeg(jpeg_file)
+            except InvalidFileError as e:
+                if verbose: print(f"{jpeg_file} - skipping: {e}")
+                continue
+            if verbose: print(f"{jpeg_file} - added")
+
+def _jpeg_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.lower().endswith((".jpg", ".jpeg")):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+def _chunk_size(value):
+    import argparse
+    chunk_size = int(value)
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise argparse.ArgumentTypeError(f"needs to be in the range 1 - {MAX_CHUNK_SIZE}")
+    return chunk_size
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create = subparsers.add_parser("create", help="Pack the thermoblobs of JPEG files / folders into an archive.")
+    create.add_argument("--chunk-size", type=_chunk_size, default=16, help="Number of frames per compressed chunk.")
+    create.add_argument("--delta", action="store_true", help="Store frames as difference to the previous frame.")
+    create.add_argument("--verbose", action="store_true")
+    create.add_argument("archive")
+    create.add_argument("jpeg_files", nargs="+")
+    extract = subparsers.add_parser("extract", help="Write the thermoblobs of an archive to .thermoblob files.")
+    extract.add_argument("--folder", default=".", help="Target folder.")
+    extract.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create_archive(args.archive, _jpeg_files(args.jpeg_files), chunk_size=args.chunk_size, delta=args.delta, verbose=args.verbose)
+    elif args.command == "extract":
+        with ArchiveReader(args.archive) as reader:
+            for i, name in enumerate(reader.names):
+                output = os.path.join(args.folder, (name or f"{i:06d}") + ".thermoblob")
+                with open(output, "wb") as f:
+                    f.write(reader[i])
+                print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""
+Batch processing of many GTC 400 C images in a pool of worker processes:
+thermogram plots, blends with the real image and thermoblob extraction.
+Each worker keeps its figure / colormaps for all images it processes.
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import glob
+import io
+import os
+import time
+
+from .jpeg import thermoblob_extr_file, index_file, SIDECAR_EXT
+from .fusion import Thermography
+from . import util
+
+def expand_inputs(inputs):
+    """ Yield the JPEG files given directly, as directories or as glob patterns """
+    for item in inputs:
+        if os.path.isdir(item):
+            for filename in sorted(os.listdir(item)):
+                if filename.lower().endswith((".jpg", ".jpeg")):
+                    yield os.path.join(item, filename)
+        elif os.path.exists(item):
+            yield item
+        else:
+            yield from sorted(glob.glob(item))
+
+def output_path(command, jpeg_file):
+    if command == "thermoblob":
+        return jpeg_file + ".thermoblob"
+    return util.remove_ext(jpeg_file) + f".{command}.png"
+
+def up_to_date(jpeg_file, output):
+    try:
+        return os.path.getmtime(output) >= os.path.getmtime(jpeg_file)
+    except OSError:
+        return False
+
+# per worker process state:
+_figure = None
+_cmap = functools.lru_cache(maxsize=None)(util.get_cmap)
+
+def process(command, jpeg_file, output, options, name=None):
+    """
+    Process a single image, runs in a worker process. jpeg_file is the
+    path of the image or its content, then name is used for the title.
+    """
+    global _figure
+    if isinstance(jpeg_file, bytes):
+        jpeg_file = io.BytesIO(jpeg_file)
+    use_index = options.get("index") and isinstance(jpeg_file, str)
+    if command == "thermoblob":
+        if use_index:
+            with open(jpeg_file, "rb") as f:
+                thermoblob = index_file(jpeg_file, sidecar=True).read_thermoblob(f)
+        else:
+            thermoblob = thermoblob_extr_file(jpeg_file)
+        with open(output, "wb") as f:
+            f.write(thermoblob)
+        return output
+    t = Thermography.from_index(jpeg_file, sidecar=True) if use_index else Thermography(jpeg_file)
+    cmap = options.get("cmap")
+    if command == "thermogram":
+        _figure = util.render_thermogram(
+            t, output, title=name or os.path.basename(jpeg_file),
+            cmap=_cmap(cmap) if cmap else None, fig=_figure,
+        )
+    elif command == "blend":
+        blend = util.blend_real_and_ir(
+            t, scale=options["scale"], shift=options["shift"], opacity=options["opacity"],
+            sat=options["sat"], cmap=cmap, auto_register=options["auto_register"],
+        )
+        blend.save(output)
+    return output
+
+def run(command, jpeg_files, options=None, jobs=None, force=False, verbose=True):
+    """
+    Process the jpeg_files with a pool of jobs worker processes (all CPUs by
+    default, 1 runs in-process). Files with an output newer than the input
+    are skipped unless force is set. Returns (processed, skipped, failed).
+    """
+    options = options or {}
+    tasks, skipped = [], 0
+    for jpeg_file in jpeg_files:
+        output = output_path(command, jpeg_file)
+        if not force and up_to_date(jpeg_file, output):
+            skipped += 1
+            continue
+        tasks.append((jpeg_file, output))
+
+    start = time.monotonic()
+    processed = failed = 0
+
+    def report(jpeg_file, future_or_result):
+        nonlocal processed, failed
+        try:
+            output = future_or_result() if callable(future_or_result) else future_or_result
+        except Exception as e:
+            failed += 1
+            if verbose: print(f"[{processed + failed}/{len(tasks)}] {jpeg_file} - failed: {e}")
+            return
+        processed += 1
+        if verbose: print(f"[{processed + failed}/{len(tasks)}] {output}")
+
+    if jobs == 1:
+        for jpeg_file, output in tasks:
+            report(jpeg_file, functools.partial(process, command, jpeg_file, output, options))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(process, command, jpeg_file, output, options): jpeg_file
+                for jpeg_file, output in tasks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                report(futures[future], future.result)
+
+    duration = time.monotonic() - start
+    if verbose:
+        rate = processed / duration if duration > 0 else 0.0
+        print(f"{processed} processed, {skipped} up to date, {failed} failed in {duration:.1f} s ({rate:.1f} images/s)")
+    return processed, skipped, failed
+
+def add_blend_arguments(parser, help_prefix=""):
+    """ Add the options of blends (like gtc400c-blend) to an argparse parser """
+    parser.add_argument("--scale", type=float, default=3.25, help=f"{help_prefix}Scale the IR image up by this factor.")
+    parser.add_argument("--shift", type=lambda x: tuple(int(e) for e in x.split(",")), default=(8, 6), help=f"{help_prefix}Shift the IR image w.r.t. the real image by this amount of pixels.")
+    parser.add_argument("--opacity", type=float, default=0.667, help=f"{help_prefix}Opacity of the IR thermography overlay, range: 0.0 - 1.0.")
+    parser.add_argument("--sat", type=float, default=0.4, help=f"{help_prefix}Saturation of the real image, range: 0.0 - 1.0.")
+    parser.add_argument("--auto-register", action="store_true", help=f"{help_prefix}Take scale, shift and flipping of the IR image from the metadata.")
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of worker processes, all CPUs by default.")
+    parser.add_argument("--force", action="store_true", help="Process images even if their output is up to date.")
+    parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--index", action="store_true", help=f"Locate the thermography data with JPEG index sidecar files (<image>{SIDECAR_EXT}), created on first use.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    thermogram = subparsers.add_parser("thermogram", help="Export thermography plots (like gtc400c-thermogram).")
+    blend = subparsers.add_parser("blend", formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="Blend IR and real images (like gtc400c-blend).")
+    subparsers.add_parser("thermoblob", help="Extract the thermoblobs.")
+    for subparser in (thermogram, blend):
+        subparser.add_argument("--cmap", metavar="CMAP_NAME", help="Colormap to use. By default, the one stored in each JPEG is used.")
+    add_blend_arguments(blend)
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("inputs", nargs="+", help="JPEG files, folders or glob patterns.")
+    args = parser.parse_args()
+
+    options = {k: v for k, v in vars(args).items() if k not in ("jobs", "force", "quiet", "command", "inputs")}
+    processed, skipped, failed = run(
+        args.command, list(expand_inputs(args.inputs)), options,
+        jobs=args.jobs, force=args.force, verbose=not args.quiet,
+    )
+    if failed:
+        parser.exit(1)
+
+if __name__ == "__main__":
+    main()
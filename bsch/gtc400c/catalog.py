@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+A persistent SQLite catalog of a library of GTC 400 C images.
+Stores the metadata of each image plus some statistics of its
+temperature matrix, so that later queries don't need to parse
+the files again. Updates are incremental by mtime and size.
+"""
+
+import os
+import sqlite3
+
+from .jpeg import InvalidFileError
+from .fusion import Thermography, matrix_array
+from .metadata import fields
+
+# metadata fields not stored in the catalog
+skipped_fields = ("reserved",)
+
+# statistics of the matrix (in °C):
+stats_columns = ("t_mean", "t_p05", "t_p50", "t_p95")
+
+def _column_value(value):
+    """ Map a decoded metadata value to a value SQLite can store """
+    if isinstance(value, tuple):
+        return ".".join(str(v) for v in value)
+    if isinstance(value, list):
+        return ",".join(value)
+    if hasattr(value, "name"):
+        return value.name
+    return value
+
+def matrix_stats(thermoblob):
+    """ Return mean and the 5/50/95 percentiles (nearest rank) of the temperature matrix """
+    values = sorted(matrix_array(thermoblob))
+    n = len(values)
+    def pct(p):
+        return round((values[round(p / 100 * (n - 1))] - 10000) / 100, 2)
+    mean = round((sum(values) / n - 10000) / 100, 2)
+    return mean, pct(5), pct(50), pct(95)
+
+class Catalog:
+
+    columns = ("path", "mtime_ns", "size") + \
+        tuple(f.name for f in fields if f.name not in skipped_fields) + stats_columns
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            + ", ".join(f'"{c}"' + (" TEXT PRIMARY KEY" if c == "path" else "") for c in self.columns)
+            + ")"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def add(self, path, st=None):
+        """ (Re-)index a single image """
+        st = st or os.stat(path)
+        t = Thermography(path)
+        row = [path, st.st_mtime_ns, st.st_size]
+        row += [_column_value(v) for f, v in t.metadata if f.name not in skipped_fields]
+        row += matrix_stats(t.thermoblob)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO images VALUES ({', '.join('?' * len(self.columns))})", row
+        )
+
+    def update(self, folder, verbose=False):
+        """
+        Index all JPEG files below folder. Files with unchanged mtime and
+        size are skipped, entries of files that are gone are removed.
+        Returns the number of (added/updated, unchanged, removed) entries.
+        """
+        folder = os.path.abspath(folder)
+        known = {
+            row["path"]: (row["mtime_ns"], row["size"])
+            for row in self.db.execute(
+                "SELECT path, mtime_ns, size FROM images WHERE path LIKE ? ESCAPE '\\'",
+                (folder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%",),
+            )
+        }
+        updated = unchanged = 0
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith((".jpg", ".jpeg")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                if known.pop(path, None) == (st.st_mtime_ns, st.st_size):
+                    unchanged += 1
+                    continue
+                try:
+                    self.add(path, st)
+                except InvalidFileError as e:
+                    if verbose: print(f"{path} - skipping: {e}")
+                    continue
+                updated += 1
+                if verbose: print(f"{path} - indexed")
+        self.db.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in known])
+        self.db.commit()
+        return updated, unchanged, len(known)
+
+    def query(self, where="1", params=(), columns=("*",), order_by="path"):
+        """
+        Return the rows matching the SQL expression where, e.g.
+        "serial = ? AND max > 80 AND material = 'Concrete'".
+        """
+        return self.db.execute(
+            f"SELECT {', '.join(columns)} FROM images WHERE {where} ORDER BY {order_by}", params
+        ).fetchall()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--db", default="gtc400c-catalog.sqlite", help="The catalog database file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update = subparsers.add_parser("update", help="Index (new or changed) images in folders.")
+    update.add_argument("--verbose", action="store_true")
+    update.add_argument("folder", nargs="+")
+    query = subparsers.add_parser("query", help="Query the catalog.")
+    query.add_argument("--columns", default="path", help=f"Comma separated columns to print, choose from: {', '.join(Catalog.columns)}")
+    query.add_argument("--order-by", default="path")
+    query.add_argument("where", nargs="?", default="1", help="SQL expression, e.g. \"serial = 123 AND max > 80 AND material = 'Concrete'\"")
+    args = parser.parse_args()
+
+    with Catalog(args.db) as catalog:
+        if args.command == "update":
+            for folder in args.folder:
+                updated, unchanged, removed = catalog.update(folder, verbose=args.verbose)
+                print(f"{folder}: {updated} indexed, {unchanged} unchanged, {removed} removed")
+        elif args.command == "query":
+            columns = [c.strip() for c in args.columns.split(",")]
+            for row in catalog.query(args.where, columns=columns, order_by=args.order_by):
+                print("\t".join(str(v) for v in row))
+
+if __name__ == "__main__":
+    main()
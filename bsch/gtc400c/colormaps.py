@@ -1,3 +1,5 @@
+import functools
+
 valid = [
     "Rainbow",
     "RainbowHM",
@@ -18,7 +20,7 @@ def colormaps():
     return valid
 
 
-# A helper function related the colormap handling in matplotlib:
+# Helper functions to look up the colormaps by name:
 
 
 def get_cmap(name, lut=None):
@@ -36,6 +38,20 @@ def get_cmap(name, lut=None):
     return cls.create_mpl_cmap(N=lut or 1024)
 
 
+def get_lut(name, N=256):
+    """
+    Return the (N, 3) uint8 lookup table of the colormap with that name,
+    without involving matplotlib.
+
+    Raises ValueError if not found.
+    """
+    if name not in colormaps():
+        raise ValueError(
+            f"'{name}' is not a valid value for name; supported values are {', '.join(colormaps())}"
+        )
+    return globals().get(name).get_lut(N)
+
+
 # The abstract Colormap class:
 
 
@@ -78,6 +94,67 @@ class Colormap:
             )
 
 
+    @classmethod
+    def get_lut(cls, N=256):
+        """
+        Return the colormap as read-only (N, 3) uint8 lookup table.
+        Computed without matplotlib (using numpy) and cached.
+        """
+        return _create_lut(cls, N)
+
+    @classmethod
+    def apply(cls, matrix, vmin=None, vmax=None, N=256, alpha=None):
+        """
+        Map the values of matrix to RGB (or RGBA, if alpha is given as
+        0..255) uint8 values with a single lookup in the table of
+        get_lut(). vmin / vmax default to the min / max of matrix.
+        """
+        return apply_lut(cls.get_lut(N), matrix, vmin=vmin, vmax=vmax, alpha=alpha)
+
+
+def apply_lut(lut, matrix, vmin=None, vmax=None, alpha=None):
+    """
+    Map the values of matrix to the colors of the (N, 3) uint8 lookup
+    table lut, see Colormap.apply().
+    """
+    import numpy as np
+
+    N = len(lut)
+    matrix = np.asarray(matrix)
+    vmin = matrix.min() if vmin is None else vmin
+    vmax = matrix.max() if vmax is None else vmax
+    scale = N / (vmax - vmin) if vmax > vmin else 0.0
+    index = ((matrix - vmin) * scale).astype(np.intp)
+    np.clip(index, 0, N - 1, out=index)
+    if alpha is not None:
+        lut = np.concatenate([lut, np.full((N, 1), alpha, dtype=np.uint8)], axis=1)
+    return lut[index]
+
+
+@functools.lru_cache(maxsize=None)
+def _create_lut(cls, N):
+    import numpy as np
+
+    xs = np.linspace(0.0, 1.0, N)
+    if cls.int_clist is not None:
+        colors = np.asarray(cls.int_clist, dtype=np.float64)
+        stops = np.linspace(0.0, 1.0, len(colors))
+        lut = np.stack([np.interp(xs, stops, colors[:, i]) for i in range(3)], axis=1)
+    else:
+        cdict = cls.get_float_cdict()
+        channels = []
+        for color in ("red", "green", "blue"):
+            x, y0, y1 = np.asarray(cdict[color], dtype=np.float64).T
+            # like matplotlib: between two stops, go from y1 of the left to y0 of the right one
+            i = np.clip(np.searchsorted(x, xs, side="right") - 1, 0, len(x) - 2)
+            frac = (xs - x[i]) / (x[i+1] - x[i])
+            channels.append((y1[i] + frac * (y0[i+1] - y1[i])) * 255)
+        lut = np.stack(channels, axis=1)
+    lut = np.clip(np.rint(lut), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
 # The individual colormaps:
 
 
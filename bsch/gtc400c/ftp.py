@@ -2,19 +2,30 @@ import ftplib
 import collections
 import os
 import io
+import json
+import threading
+import time
 from typing import Union
 
+from .jpeg import ThermoblobParser, InvalidFileError
+from .fusion import Thermography
+
 File = collections.namedtuple("File", ("permissions", "linkcount", "user", "group", "size", "month", "day", "time", "name"))
 
 class FTP(ftplib.FTP):
     def __init__(self, *args, **kwargs):
-        if len(args) == 0:
-            # using the default host:
-            ftplib.FTP.__init__(self, "192.168.1.1", *args, **kwargs)
-        else:
-            # custom call overriding the first argument ("host"):
-            ftplib.FTP.__init__(self, *args, **kwargs)
-        self.cwd("IMAGE")
+        try:
+            if len(args) == 0:
+                # using the default host:
+                ftplib.FTP.__init__(self, "192.168.1.1", *args, **kwargs)
+            else:
+                # custom call overriding the first argument ("host"):
+                ftplib.FTP.__init__(self, *args, **kwargs)
+            self.cwd("IMAGE")
+        except BaseException:
+            # e.g. 421 when the device has too many connections
+            self.close()
+            raise
 
     def list_files(self):
         files = []
@@ -24,18 +35,70 @@ class FTP(ftplib.FTP):
         return files
 
 
-    def download(self, file: Union[str, File], fp=None):
+    def download(self, file: Union[str, File], fp=None, blocksize=8192, rest=None):
         if type(file) == File:
             file = file.name
         if fp is None:
             fp = io.BytesIO()
-        self.retrbinary(f"RETR IMAGE/{file}", fp.write, blocksize=8192)
+        self.retrbinary(f"RETR IMAGE/{file}", fp.write, blocksize=blocksize, rest=rest)
         fp.seek(0)
         return fp
 
+    def read_thermoblob(self, file: Union[str, File], blocksize=8192):
+        """
+        Stream the file into an incremental thermoblob parser and stop the
+        transfer as soon as the thermoblob is complete.
+        Returns the thermoblob and the number of bytes transferred.
+        """
+        if type(file) == File:
+            file = file.name
+        parser = ThermoblobParser()
+        received = 0
+        self.voidcmd("TYPE I")
+        conn = self.transfercmd(f"RETR IMAGE/{file}")
+        try:
+            with conn:
+                while not parser.done:
+                    data = conn.recv(blocksize)
+                    if not data:
+                        break
+                    received += len(data)
+                    parser.feed(data)
+        finally:
+            # also after an InvalidFileError, to keep the control connection
+            # in step: closing the data connection early ends the transfer,
+            # the device then replies with either 226 (complete) or 4xx (aborted)
+            try:
+                self.voidresp()
+            except ftplib.error_temp:
+                pass
+        return parser.close(), received
+
+    def thermographies(self, files=None, on_invalid=None):
+        """
+        Yield (File, Thermography, bytes transferred) for the files
+        (default: all files on the device), reading only their thermoblobs.
+        Files without thermoblob are skipped after calling
+        on_invalid(file, error), if given.
+        """
+        for file in self.list_files() if files is None else files:
+            try:
+                thermoblob, received = self.read_thermoblob(file)
+            except InvalidFileError as e:
+                if on_invalid: on_invalid(file, e)
+                continue
+            yield file, Thermography.from_thermoblob(thermoblob), received
+
     # The GTC 400 C doesn't support many commands. It then responds with
     # > 202 Command not implemented, superfluous at this site.
 
+    def sendcmd(self, cmd):
+        resp = ftplib.FTP.sendcmd(self, cmd)
+        # ftplib takes the 202 reply to an unsupported REST as success:
+        if cmd.startswith("REST ") and not resp.startswith("3"):
+            raise ftplib.error_reply(resp)
+        return resp
+
     def delete(self, filename):
         raise NotImplementedError()
 
@@ -48,20 +111,246 @@ class FTP(ftplib.FTP):
     def nlst(*args):
         raise NotImplementedError()
 
+MANIFEST = ".gtc400c-ftp.json"
+
+def close_quietly(session):
+    if session.sock is None:
+        return
+    try:
+        session.quit()
+    except ftplib.all_errors:
+        pass
+    finally:
+        session.close()
+
+def adaptive_blocksize(rate, target=0.05, minimum=8192, maximum=262144):
+    """ Blocksize receiving about target seconds of data per read at rate (bytes/s) """
+    blocksize = 1 << max(int(rate * target), 1).bit_length()
+    return max(minimum, min(maximum, blocksize))
+
+def fetch(session, file: File, folder, blocksize=8192):
+    """
+    Download file to folder via a temporary .part file, which is renamed
+    once complete. A .part file left by an interrupted download is resumed
+    with REST, or downloaded again if the device refuses that.
+    Returns the number of bytes transferred.
+    """
+    target_path = os.path.join(folder, file.name)
+    part_path = target_path + ".part"
+    size = int(file.size)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset >= size:
+        offset = 0
+    try:
+        with open(part_path, 'r+b' if offset else 'wb') as fp:
+            fp.seek(offset)
+            try:
+                session.download(file, fp=fp, blocksize=blocksize, rest=offset or None)
+            except ftplib.error_reply:
+                # REST not supported: start over
+                if not offset:
+                    raise
+                fp.seek(0)
+                fp.truncate(0)
+                offset = 0
+                session.download(file, fp=fp, blocksize=blocksize)
+    except BaseException:
+        # keep partial data for resuming, but no empty files
+        if not os.path.getsize(part_path):
+            os.remove(part_path)
+        raise
+    received = os.path.getsize(part_path)
+    if received != size:
+        raise ftplib.Error(f"incomplete download ({received} of {size} bytes)")
+    os.replace(part_path, target_path)
+    return size - offset
+
+def download_files(files, folder, connections=2, connect=FTP, verbose=True, on_complete=None, max_attempts=3):
+    """
+    Download the files (list of File) to folder, spread over a pool of up
+    to connections FTP sessions created by calling connect(). The
+    blocksize of each session adapts to its measured throughput.
+    A session that loses its connection is replaced and the file is
+    resumed, up to max_attempts times per file. Workers which can't
+    (re)connect stop and leave their files to the remaining ones.
+    on_complete(file) is called (serialized) after each finished file.
+    Returns the number of downloaded files and bytes and the duration.
+    """
+    if not files:
+        return 0, 0, 0.0
+    tasks = collections.deque(files)
+    # guards tasks, totals and attempts, signals released files
+    cond = threading.Condition()
+    totals = {"files": 0, "bytes": 0, "failed": 0, "busy": 0}
+    attempts = collections.Counter()
+    start = time.monotonic()
+
+    def take():
+        """ The next file or None, waits while other workers may still put theirs back """
+        with cond:
+            while not tasks:
+                if not totals["busy"]:
+                    return None
+                cond.wait()
+            totals["busy"] += 1
+            return tasks.popleft()
+
+    def release(requeue=None):
+        with cond:
+            if requeue is not None:
+                tasks.append(requeue)
+            totals["busy"] -= 1
+            cond.notify_all()
+
+    def worker():
+        session = None
+        blocksize = 8192
+        try:
+            while True:
+                # connect before taking a file, so that a worker failing
+                # to (re)connect never holds one
+                if session is None:
+                    with cond:
+                        if not tasks and not totals["busy"]:
+                            return
+                    try:
+                        session = connect()
+                    except ftplib.all_errors as e:
+                        if verbose: print(f"Could not open a connection: {e}")
+                        return
+                file = take()
+                if file is None:
+                    return
+                requeue = None
+                try:
+                    t0 = time.monotonic()
+                    try:
+                        size = fetch(session, file, folder, blocksize=blocksize)
+                    except (ftplib.error_perm, ftplib.error_reply, ftplib.error_proto) as e:
+                        # the device refused this file
+                        with cond:
+                            totals["failed"] += 1
+                            if verbose: print(f"{file.name} - download failed: {e}")
+                        continue
+                    except ftplib.all_errors as e:
+                        # connection lost (or an incomplete transfer): reconnect
+                        # and retry, resuming from the .part file
+                        close_quietly(session)
+                        session = None
+                        with cond:
+                            attempts[file.name] += 1
+                            if attempts[file.name] < max_attempts:
+                                requeue = file
+                                if verbose: print(f"{file.name} - connection lost ({e}), retrying")
+                            else:
+                                totals["failed"] += 1
+                                if verbose: print(f"{file.name} - download failed: {e}")
+                        continue
+                    duration = max(time.monotonic() - t0, 1e-6)
+                    blocksize = adaptive_blocksize(size / duration)
+                    with cond:
+                        totals["files"] += 1
+                        totals["bytes"] += size
+                        if on_complete: on_complete(file)
+                        if verbose: print(f"{file.name} - download complete ({size} bytes, {size / duration / 1024:.0f} KiB/s)")
+                finally:
+                    release(requeue)
+        finally:
+            if session is not None:
+                close_quietly(session)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(connections, len(files))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - start
+    if verbose and totals["files"]:
+        print(f"{totals['files']} files, {totals['bytes']} bytes in {duration:.1f} s ({totals['bytes'] / max(duration, 1e-6) / 1024:.0f} KiB/s)")
+    if tasks or totals["failed"]:
+        raise ftplib.Error(f"{len(tasks) + totals['failed']} files could not be downloaded")
+    return totals["files"], totals["bytes"], duration
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def listing(file: File):
+    """ What the manifest records of a file to detect changes """
+    return {"size": int(file.size), "month": file.month, "day": file.day, "time": file.time}
+
+def sync(folder, connections=1, connect=FTP, force=False, verbose=True):
+    """
+    Bring folder up to date with the images on the device. A manifest in
+    the folder records the listing (size, date and time) of the synced
+    files, only new or changed files are downloaded. Local files which
+    match the listed size but predate the manifest are adopted.
+    Returns the number of downloaded files.
+    """
+    manifest = {} if force else load_manifest(folder)
+    session = connect()
+    try:
+        files = session.list_files()
+        pending = []
+        for file in files:
+            target_path = os.path.join(folder, file.name)
+            exists = os.path.exists(target_path)
+            if not force and exists and os.path.getsize(target_path) == int(file.size):
+                if manifest.get(file.name) == listing(file):
+                    continue
+                if file.name not in manifest:
+                    manifest[file.name] = listing(file)
+                    if verbose: print(f"{file.name} - already downloaded - skipping...")
+                    continue
+            pending.append(file)
+        save_manifest(folder, manifest)
+
+        def record(file):
+            manifest[file.name] = listing(file)
+            save_manifest(folder, manifest)
+
+        # the listing session is reused as the first one of the pool
+        spare = [session]
+        def pool_connect():
+            try:
+                return spare.pop()
+            except IndexError:
+                return connect()
+
+        downloaded, _, _ = download_files(pending, folder, connections=connections, connect=pool_connect, verbose=verbose, on_complete=record)
+    finally:
+        close_quietly(session)
+    return downloaded
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--folder", default=".", help="Target folder for downloaded images.")
-    parser.add_argument("--force", action="store_true", help="Overwrite existing files.")
+    parser.add_argument("--force", action="store_true", help="Download all files again.")
+    parser.add_argument("--connections", type=int, default=1, help="Number of parallel FTP connections to the device.")
+    parser.add_argument("--metadata", action="store_true", help="Don't download, list the metadata of the images on the device instead.")
     args = parser.parse_args()
 
-    with FTP() as gtc400c:
-        files = gtc400c.list_files()
-        for file in files:
-            target_path = os.path.join(args.folder, file.name)
-            if os.path.exists(target_path) and not args.force:
-                print(f"{file.name} - already downloaded - skipping...")
-                continue
-            with open(target_path, 'wb') as fp:
-                gtc400c.download(file, fp=fp)
-                print(f"{file.name} - download complete")
+    if args.metadata:
+        transferred = total = 0
+        with FTP() as gtc400c:
+            def skip(file, error):
+                print(f"{file.name} - skipping: {error}")
+            for file, t, received in gtc400c.thermographies(on_invalid=skip):
+                transferred += received
+                total += int(file.size)
+                print(f"{file.name}  min: {t.get('min'):.2f}  max: {t.get('max'):.2f}  {t.get('material').name}  ε={t.get('epsilon')}")
+        print(f"transferred {transferred} of {total} bytes")
+        return
+
+    downloaded = sync(args.folder, connections=args.connections, force=args.force)
+    print(f"{downloaded} files downloaded")
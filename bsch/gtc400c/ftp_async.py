@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+An asyncio FTP client for the GTC 400 C, with the same device quirks
+as bsch.gtc400c.ftp.FTP. One event loop can service many devices and
+overlap transfers with parsing.
+
+Example:
+
+    async with AsyncFTP() as gtc400c:
+        for file in await gtc400c.list_files():
+            async with contextlib.aclosing(gtc400c.download(file)) as chunks:
+                async for chunk in chunks:
+                    ...
+"""
+
+import asyncio
+import ftplib
+from typing import Union
+
+from .ftp import File
+from .jpeg import ThermoblobParser
+
+class AsyncFTP:
+
+    def __init__(self, host="192.168.1.1", port=21, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+        # one command / transfer at a time on the control connection:
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        self.welcome = await self.getresp()
+        await self.cwd("IMAGE")
+        return self.welcome
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.quit()
+
+    async def quit(self):
+        if self.writer is None:
+            return
+        try:
+            async with self.lock:
+                await self._sendcmd("QUIT")
+        except (ftplib.Error, OSError, EOFError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def _getline(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise EOFError("connection closed by the device")
+        return line.decode("latin-1").rstrip("\r\n")
+
+    async def getresp(self):
+        """ Read a (multi-line) reply, raise ftplib's exceptions like ftplib.FTP.getresp() """
+        resp = line = await self._getline()
+        if line[3:4] == "-":
+            code = line[:3]
+            while not (line[:3] == code and line[3:4] != "-"):
+                line = await self._getline()
+                resp += "\n" + line
+        if resp[:1] in ("1", "2", "3"):
+            return resp
+        if resp[:1] == "4":
+            raise ftplib.error_temp(resp)
+        if resp[:1] == "5":
+            raise ftplib.error_perm(resp)
+        raise ftplib.error_proto(resp)
+
+    async def _sendcmd(self, cmd):
+        self.writer.write(cmd.encode("latin-1") + b"\r\n")
+        await self.writer.drain()
+        return await self.getresp()
+
+    async def sendcmd(self, cmd):
+        async with self.lock:
+            return await self._sendcmd(cmd)
+
+    async def voidcmd(self, cmd):
+        resp = await self.sendcmd(cmd)
+        if resp[:1] != "2":
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def cwd(self, dirname):
+        return await self.voidcmd(f"CWD {dirname}")
+
+    async def _transfer(self, cmd, type_="I"):
+        """ Open a passive data connection for cmd, expects the lock to be held """
+        await self._sendcmd(f"TYPE {type_}")
+        _, port = ftplib.parse227(await self._sendcmd("PASV"))
+        # like ftplib, don't trust the address in the PASV reply
+        host = self.writer.get_extra_info("peername")[0]
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        try:
+            resp = await self._sendcmd(cmd)
+            if resp[:1] not in ("1", "2"):
+                raise ftplib.error_reply(resp)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def list_files(self):
+        async with self.lock:
+            reader, writer = await self._transfer("LIST", type_="A")
+            try:
+                data = await asyncio.wait_for(reader.read(), self.timeout)
+            finally:
+                writer.close()
+            await self.getresp()
+        return [File(*line.split()) for line in data.decode("latin-1").splitlines() if line.strip()]
+
+    async def download(self, file: Union[str, File], blocksize=8192):
+        """
+        Async generator yielding the content of the file in chunks. Closing
+        it early (e.g. with contextlib.aclosing()) aborts the transfer.
+        """
+        if type(file) == File:
+            file = file.name
+        async with self.lock:
+            reader, writer = await self._transfer(f"RETR IMAGE/{file}")
+            try:
+                while True:
+                    chunk = await asyncio.wait_for(reader.read(blocksize), self.timeout)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                writer.close()
+                # after an early close, the device replies 226 or 4xx:
+                try:
+                    await self.getresp()
+                except ftplib.error_temp:
+                    pass
+
+    async def read_thermoblob(self, file: Union[str, File], blocksize=8192):
+        """
+        Read just as much of the file as needed to extract its thermoblob.
+        Returns the thermoblob and the number of bytes transferred.
+        """
+        parser = ThermoblobParser()
+        received = 0
+        chunks = self.download(file, blocksize=blocksize)
+        try:
+            async for chunk in chunks:
+                received += len(chunk)
+                if parser.feed(chunk):
+                    break
+        finally:
+            await chunks.aclose()
+        return parser.close(), received
+
+    # The GTC 400 C doesn't support many commands. It then responds with
+    # > 202 Command not implemented, superfluous at this site.
+
+    async def delete(self, filename):
+        raise NotImplementedError()
+
+    async def rename(self, fromname, toname):
+        raise NotImplementedError()
+
+    async def mlsd(self, path="", facts=[]):
+        raise NotImplementedError()
+
+    async def nlst(self, *args):
+        raise NotImplementedError()
@@ -1,44 +1,190 @@
 #!/usr/bin/env python
 
-import struct
+import array
+import functools
 import io
-from typing import Union
+import mmap
+import os
+import sys
+from typing import Union, BinaryIO
 
-from .jpeg import thermoblob_extr
-from .metadata import metadata_extr
+from .jpeg import thermoblob_extr, thermoblob_extr_file, index_file
+from .metadata import Metadata
+
+N_ROWS, N_COLS = 120, 160
+
+# unit -> (factor, offset) to convert from deg C
+UNITS = {
+    "°C": (1.0, 0.0),
+    "°F": (1.8, 32.0),
+    "K": (1.0, 273.15),
+}
+
+@functools.lru_cache(maxsize=None)
+def have_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+def matrix_array(thermoblob):
+    """
+    Get the raw matrix of the thermoblob as array('H') of 19200 values.
+    The values are centi-degrees with an offset of 10000.
+    """
+    matrix = array.array("H")
+    matrix.frombytes(thermoblob[0x20:0x20+2*N_ROWS*N_COLS])
+    if sys.byteorder == "big":
+        matrix.byteswap()
+    return matrix
 
 
 class Thermography:
 
     unit = "°C"
 
-    def __init__(self, jpeg_data: Union[bytes, str]):
-        if type(jpeg_data) == str:
-            with open(jpeg_data, "rb") as f:
-                jpeg_data = f.read()
-        self.jpeg_data = jpeg_data
-        self.thermoblob = thermoblob_extr(jpeg_data)
-        self.metadata = list(metadata_extr(self.thermoblob))
+    def __init__(self, jpeg_data: Union[bytes, str, BinaryIO]):
+        """
+        jpeg_data can be the content of the JPEG file, its path or a binary
+        file-like object. For the latter two, only the header of the file
+        is read, the full JPEG data is loaded on first use of .jpeg_data.
+        If jpeg_data is a memoryview, the thermoblob is a view into it, too.
+        """
+        if isinstance(jpeg_data, (bytes, bytearray, memoryview, mmap.mmap)):
+            self._source = None
+            self._jpeg_data = jpeg_data
+            self.thermoblob = thermoblob_extr(jpeg_data)
+        else:
+            self._source = jpeg_data
+            self._jpeg_data = None
+            self.thermoblob = thermoblob_extr_file(jpeg_data)
+        self.metadata = Metadata(self.thermoblob)
+
+    @classmethod
+    def from_thermoblob(cls, thermoblob):
+        """ Create a Thermography from the thermoblob alone, without the JPEG (and real image) """
+        self = cls.__new__(cls)
+        self._source = None
+        self._jpeg_data = None
+        self.thermoblob = thermoblob
+        self.metadata = Metadata(thermoblob)
+        return self
+
+    @property
+    def jpeg_data(self):
+        if self._jpeg_data is None:
+            if self._source is None:
+                raise ValueError("No JPEG data available, this Thermography was created from a thermoblob")
+            if isinstance(self._source, (str, os.PathLike)):
+                with open(self._source, "rb") as f:
+                    self._jpeg_data = f.read()
+            else:
+                self._source.seek(0)
+                self._jpeg_data = self._source.read()
+        return self._jpeg_data
+
+    @classmethod
+    def from_mmap(cls, path):
+        """
+        Create a Thermography backed by a read-only memory map of the file.
+        The thermoblob and the matrix from get_matrix_raw() are views into
+        the mapped pages, so only what is actually accessed gets loaded.
+
+        Before Python 3.13, each map keeps a duplicate of the file descriptor
+        open, which limits the number of images mapped at once to the limit
+        of open files (ulimit -n, often 1024). From 3.13 on, the map doesn't
+        hold a descriptor.
+        """
+        kwargs = {"trackfd": False} if sys.version_info >= (3, 13) else {}
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, **kwargs)
+        return cls(memoryview(mapped))
+
+    @classmethod
+    def from_index(cls, path, sidecar=False):
+        """
+        Create a Thermography reading just the thermoblob at the offsets
+        found in the JpegIndex of the file, see jpeg.index_file(). With
+        sidecar=True, later runs reuse the index stored next to the image.
+        """
+        index = index_file(path, sidecar=sidecar)
+        with open(path, "rb") as f:
+            self = cls.from_thermoblob(index.read_thermoblob(f))
+        self._source = path
+        return self
 
     def get(self, key):
-        return {f.name: v for f, v in self.metadata}[key]
+        return self.metadata[key]
 
-    def get_matrix_np(self):
+    def get_matrix_raw(self):
+        """ Get the raw uint16 matrix (120 x 160) as NumPy array without copying the data """
         import numpy as np
-        matrix = np.frombuffer(self.thermoblob[0x20:0x9620], dtype=np.uint16)
-        matrix = matrix.reshape((120, 160))
-        matrix = (matrix - 10000) * 0.01 # scaling to deg C
-        return matrix
+        matrix = np.frombuffer(self.thermoblob, dtype="<u2", count=19200, offset=0x20)
+        return matrix.reshape((120, 160))
+
+    def get_unit(self):
+        """ The unit selected on the device, °F if the DegreeF display setting is active, else °C """
+        return "°F" if "DegreeF" in self.get("display_settings") else "°C"
+
+    def get_matrix_np(self, dtype=None, unit="°C", out=None):
+        """
+        Get the matrix (120 x 160) as NumPy array.
+
+        dtype: float64 (default), float32 or an integer type for centi-degrees,
+               integers require unit °C and raise ValueError if a value
+               doesn't fit (e.g. int16 above 327.67 °C)
+        unit:  "°C", "°F", "K" or "device" for the unit selected on the device
+        out:   optional preallocated array of shape (120, 160) to write to
+        """
+        import numpy as np
+        if unit == "device":
+            unit = self.get_unit()
+        factor, offset = UNITS[unit]
+        if dtype is None:
+            dtype = out.dtype if out is not None else np.float64
+        dtype = np.dtype(dtype)
+        if dtype.kind in "iu" and unit != "°C":
+            raise ValueError("integer centi-degrees are only available in °C")
+        if out is None:
+            out = np.empty((N_ROWS, N_COLS), dtype=dtype)
+        elif out.shape != (N_ROWS, N_COLS) or out.dtype != dtype:
+            raise ValueError(f"out needs shape {(N_ROWS, N_COLS)} and dtype {dtype}")
+        raw = self.get_matrix_raw()
+        if dtype.kind in "iu":
+            info = np.iinfo(dtype)
+            low, high = int(raw.min()) - 10000, int(raw.max()) - 10000
+            if low < info.min or high > info.max:
+                raise ValueError(f"centi-degrees from {low} to {high} don't fit into {dtype}")
+        # computing in the output dtype avoids the uint16 wrap-around below 0 °C
+        np.subtract(raw, 10000, out=out, dtype=dtype, casting="unsafe")
+        if dtype.kind in "iu":
+            return out
+        np.divide(out, 100, out=out) # scaling to deg C
+        if factor != 1.0:
+            np.multiply(out, factor, out=out)
+        if offset != 0.0:
+            np.add(out, offset, out=out)
+        return out
+
+    def get_matrix_array(self):
+        """ Get the raw matrix as flat array('H'), see matrix_array() """
+        return matrix_array(self.thermoblob)
 
     def get_matrix_lst(self):
         """ Get the array as a list of 120 x 160 values """
-        matrix = struct.unpack("<19200H", self.thermoblob[0x20:0x20+38400])
-        # reshape the list
-        n_rows, n_cols = 120, 160
-        matrix = [list(matrix[i*n_cols:(i+1)*n_cols]) for i in range(n_rows)]
-        # scale to deg C and round to 2 decimals:
-        matrix = [[round((v-10000)*0.01, 2) for v in row] for row in matrix]
-        return matrix
+        if have_numpy():
+            import numpy as np
+            return ((self.get_matrix_raw().astype(np.int32) - 10000) / 100).tolist()
+        matrix = self.get_matrix_array()
+        # scale to deg C, the division yields the same values as round((v-10000)*0.01, 2):
+        return [[(v - 10000) / 100 for v in matrix[i*N_COLS:(i+1)*N_COLS]] for i in range(N_ROWS)]
+
+    def get_matrix(self):
+        """ Get the matrix in deg C, as NumPy array if available, as list of lists otherwise """
+        if have_numpy():
+            return self.get_matrix_np()
+        return self.get_matrix_lst()
 
     def get_real_im(self):
         from PIL import Image
@@ -4,6 +4,13 @@ Main task: extract the 'thermoblob', i.e. the binary
 thermography data embedded into the file.
 """
 
+import collections
+import functools
+import json
+import mmap
+import os
+import re
+
 VERBOSE = False
 
 segment_signatures = [
@@ -18,95 +25,285 @@ segment_signatures = [
   {'name': 'EOI',         'marker': b'\xFF\xD9', 'length': 0},
 ]
 
+Segment = collections.namedtuple("Segment", ("name", "offset", "length"))
+
+SIDECAR_EXT = ".idx"
+
 class InvalidFileError(Exception):
     pass
 
-def thermoblob_extr(jpeg_data):
-    """ Extract the thermoblob from the given JPEG data """
+# marker byte (the one following 0xFF) -> segment name
+marker_names = {segdef['marker'][1]: segdef['name'] for segdef in segment_signatures}
+
+# markers without a length header: TEM, RST0..RST7, SOI, EOI
+standalone_markers = {0x01, *range(0xD0, 0xD8), 0xD8, 0xD9}
 
-    thermoblob = None
+# The next real marker in entropy-coded data: an 0xFF that is neither
+# a stuffed byte (FF 00), a restart marker (FF D0..D7) nor fill (FF FF).
+next_marker_re = re.compile(rb'\xFF(?=[^\x00\xD0-\xD7\xFF])')
 
-    content = jpeg_data
+def iter_segments(jpeg_data):
+    """
+    Iterate over the segments of the given JPEG data, yielding
+    Segment(name, offset, length) tuples. The offset points to the 0xFF of the
+    marker and the length covers the full segment including its marker.
+    The scan data following SOS is accounted to the SOS segment and data
+    after EOI is reported as a segment named 'trailing'.
+
+    jpeg_data can be any bytes-like object supporting the regular
+    expression engine, e.g. bytes, bytearray, memoryview or mmap.
+    """
+
+    size = len(jpeg_data)
 
     # SOI - Start of Image
-    assert content[0:2] == b'\xFF\xD8'
+    if jpeg_data[0:2] != b'\xFF\xD8':
+        raise InvalidFileError("Not a JPEG file: SOI marker missing")
     # APPO - JFIF tag
-    assert content[2:4] == b'\xFF\xE0'
-    assert content[6:11] == b'\x4A\x46\x49\x46\x00'
-    
-    
+    if jpeg_data[2:4] != b'\xFF\xE0' or jpeg_data[6:11] != b'\x4A\x46\x49\x46\x00':
+        raise InvalidFileError("Not a JFIF file: APP0 segment missing")
+
     pos = 0
-    eoi_found = False
-    while True:
-        marker = content[pos:pos+2]
-        if VERBOSE: print(f"0x{pos:08X} - {marker[0]:02X} {marker[1]:02X} - ", end='')
-        last_pos = pos
-        for segdef in segment_signatures:
-            if marker == segdef['marker'] and segdef.get('length') == 0:
-                pos += 2
-                if VERBOSE: print(f"Found {segdef['name']} segment.")
-                if segdef['name'] == 'EOI':
-                    eoi_found = True
+    while pos < size - 1:
+        code = jpeg_data[pos+1]
+        if jpeg_data[pos] != 0xFF or code in (0x00, 0xFF):
+            # not at a marker: resynchronise with the next one
+            match = next_marker_re.search(jpeg_data, pos + 1)
+            if match is None:
                 break
-            if marker == segdef['marker'] and segdef.get('length') == 'header' and content[pos+4:pos+9] == segdef.get('signature') or \
-               marker == segdef['marker'] and segdef.get('length') == 'header' and 'signature' not in segdef:
-                length = content[pos+2] * 256 + content[pos+3]
-                if VERBOSE: print(f"Found {segdef['name']} segment with {length} bytes length.")
-                if segdef['name'] == "BSCH-APPF":
-                    thermoblob = content[pos+4:pos+2+length]
-                    # basically we can abort reading the file at this point...
-                    return thermoblob
-                pos += 2 + length
+            if VERBOSE: print(f"0x{pos:08X} - skipping {match.start() - pos} bytes of unknown data")
+            pos = match.start()
+            continue
+        name = marker_names.get(code, f"0xFF{code:02X}")
+        if code in standalone_markers:
+            if VERBOSE: print(f"0x{pos:08X} - FF {code:02X} - Found {name} segment.")
+            yield Segment(name, pos, 2)
+            pos += 2
+            if code == 0xD9:
                 break
-            if marker == segdef['marker'] and segdef.get('length') == 'scan':
-                if VERBOSE: print(f"Found {segdef['name']} segment. Reading...")
-                delete_pos = []
-                length = 0
-                payload = b''
-                while True:
-                    if length % (1024*1024) == 0:
-                        if VERBOSE: print(f"{length/(1024*1024)} MiB")
-                    if content[pos+2+length:pos+2+length+2] == b'\xff\x00':
-                        # FF 00 (FF in data, 00 as noop)
-                        delete_pos.append(length+1)
-                        length += 2
-                    elif content[pos+2+length] == 255 and content[pos+2+length+1] in range(208, 208+8):
-                        # FF (D0..D7)
-                        delete_pos.append(length)
-                        delete_pos.append(length+1)
-                        length += 2
-                    elif content[pos+2+length] == 255:
-                        # FF with following byte other than 00, D0..D7 (-> new segment)
-                        #payload = list(content[pos+2:pos+2+length])
-                        # Takes too much time... skip for now:
-                        #if VERBOSE: print(f"payload size before deleting zeros: {len(payload)}")
-                        #for payload_pos in reversed(sorted(delete_pos)):
-                        #    del payload[payload_pos]
-                        #if VERBOSE: print(f"payload size after deleting zeros: {len(payload)}")
-                        #payload = bytes(payload)
-                        #if VERBOSE: print(f"payload (bytes) size after deleting zeros: {len(payload)}")
-                        pos += 2 + length
-                        break
-                    else:
-                        length += 1
-                if VERBOSE: print(f"Found {segdef['name']} segment with {length} bytes length.")
-        if eoi_found:
-            break
-        if pos == last_pos and pos < len(content):
-            if VERBOSE: print(f"unknown marker: {marker} @ pos {pos:X}h")
-            pos += 1
-        if pos == len(content)-1:
+            continue
+        if pos + 4 > size:
             break
-    if pos < len(content):
-        trailing_content = content[pos:]
-        if VERBOSE: print(f"0x{pos:08X} Trailing content: {len(trailing_content)} bytes long")
-    else:
-        if VERBOSE: print(f"No trailing content.")
+        end = pos + 2 + (jpeg_data[pos+2] << 8 | jpeg_data[pos+3])
+        if code == 0xDA:
+            # skip the entropy-coded data up to the next marker
+            match = next_marker_re.search(jpeg_data, end)
+            end = match.start() if match else size
+        if VERBOSE: print(f"0x{pos:08X} - FF {code:02X} - Found {name} segment with {end - pos} bytes length.")
+        yield Segment(name, pos, end - pos)
+        pos = end
+    if pos < size:
+        if VERBOSE: print(f"0x{pos:08X} Trailing content: {size - pos} bytes long")
+        yield Segment('trailing', pos, size - pos)
+
+def thermoblob_extr(jpeg_data):
+    """ Extract the thermoblob from the given JPEG data """
+
+    for name, offset, length in iter_segments(jpeg_data):
+        if name == 'BSCH-APPF':
+            if offset + length > len(jpeg_data):
+                raise InvalidFileError("The thermography data is truncated")
+            return jpeg_data[offset+4:offset+length]
+
+    raise InvalidFileError("No thermography data found, please open an image like RB-----Y.JPG")
+
+class ThermoblobParser:
+    """
+    Incremental thermoblob extraction: feed() the JPEG data chunk by chunk
+    until it returns True, then pick up the result from .thermoblob.
+    Scan data is discarded as it passes, so memory use stays bounded.
+    """
+
+    def __init__(self):
+        self.thermoblob = None
+        self.buffer = bytearray()
+        self.offset = 0      # absolute file offset of buffer[0]
+        self.pos = 0         # parse position within the buffer
+        self.in_scan = False
+
+    @property
+    def done(self):
+        return self.thermoblob is not None
+
+    def feed(self, data):
+        """ Add the next chunk of data, returns True once the thermoblob is complete """
+        if self.done:
+            return True
+        self.buffer += data
+        self._parse()
+        return self.done
 
-    if thermoblob is None:
-        raise InvalidFileError("No thermography data found, please open an image like RB-----Y.JPG")
+    def close(self):
+        """ Signal the end of the data, raises InvalidFileError if no thermoblob was found """
+        if not self.done:
+            raise InvalidFileError("No thermography data found, please open an image like RB-----Y.JPG")
+        return self.thermoblob
 
-    return thermoblob
+    def _parse(self):
+        buf = self.buffer
+        while not self.done:
+            if self.offset == 0 and self.pos == 0:
+                if len(buf) < 11:
+                    return
+                if buf[0:2] != b'\xFF\xD8':
+                    raise InvalidFileError("Not a JPEG file: SOI marker missing")
+                if buf[2:4] != b'\xFF\xE0' or buf[6:11] != b'\x4A\x46\x49\x46\x00':
+                    raise InvalidFileError("Not a JFIF file: APP0 segment missing")
+            if self.in_scan:
+                match = next_marker_re.search(buf, self.pos)
+                if match is None:
+                    # keep the last byte, it might be the 0xFF of a marker
+                    drop = max(len(buf) - 1, 0)
+                    del buf[:drop]
+                    self.offset += drop
+                    self.pos = 0
+                    return
+                self.pos = match.start()
+                self.in_scan = False
+            pos = self.pos
+            if len(buf) - pos < 2:
+                return
+            code = buf[pos+1]
+            if buf[pos] != 0xFF or code in (0x00, 0xFF):
+                # not at a marker: resynchronise with the next one
+                self.pos += 1
+                self.in_scan = True
+                continue
+            if code == 0xD9:
+                raise InvalidFileError("No thermography data found, please open an image like RB-----Y.JPG")
+            if code in standalone_markers:
+                self.pos += 2
+                continue
+            if len(buf) - pos < 4:
+                return
+            end = pos + 2 + (buf[pos+2] << 8 | buf[pos+3])
+            if end > len(buf):
+                return
+            if code == 0xEF:
+                self.thermoblob = bytes(buf[pos+4:end])
+                return
+            if code == 0xDA:
+                self.in_scan = True
+            self.pos = end
+
+def thermoblob_extr_file(file, chunk_size=16384):
+    """
+    Extract the thermoblob from a JPEG file given by its path or as
+    binary file-like object. Only reads as far as needed.
+    """
+
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            return thermoblob_extr_file(f, chunk_size=chunk_size)
+
+    parser = ThermoblobParser()
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return parser.close()
+        if parser.feed(chunk):
+            return parser.thermoblob
+
+class JpegIndex:
+    """
+    The list of segments of a JPEG file with their offsets and lengths.
+    Can be stored as a small JSON sidecar file next to the image.
+    """
+
+    def __init__(self, segments, size, mtime_ns=None):
+        self.segments = [Segment(*segment) for segment in segments]
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @classmethod
+    def from_data(cls, jpeg_data, mtime_ns=None):
+        return cls(iter_segments(jpeg_data), len(jpeg_data), mtime_ns=mtime_ns)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __repr__(self):
+        return f"<JpegIndex: {len(self)} segments, {self.size} bytes>"
+
+    def find(self, name):
+        """ Return the first segment with that name or None """
+        for segment in self.segments:
+            if segment.name == name:
+                return segment
+        return None
+
+    def thermoblob_range(self):
+        """ Return the (start, stop) offsets of the thermoblob within the file """
+        segment = self.find('BSCH-APPF')
+        if segment is None:
+            raise InvalidFileError("No thermography data found, please open an image like RB-----Y.JPG")
+        return segment.offset + 4, segment.offset + segment.length
+
+    def read_thermoblob(self, fp):
+        """ Read the thermoblob from the binary file object fp using the index """
+        start, stop = self.thermoblob_range()
+        fp.seek(start)
+        thermoblob = fp.read(stop - start)
+        if len(thermoblob) != stop - start:
+            raise InvalidFileError("The thermography data is truncated")
+        return thermoblob
+
+    def to_bytes(self):
+        return json.dumps({
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'segments': [list(segment) for segment in self.segments],
+        }).encode('ascii')
+
+    @classmethod
+    def from_bytes(cls, data):
+        obj = json.loads(data)
+        return cls(obj['segments'], obj['size'], mtime_ns=obj['mtime_ns'])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+def index_file(path, sidecar=False):
+    """
+    Return the JpegIndex of the JPEG file at path.
+
+    Results are cached in-process, keyed by path, mtime and size.
+    With sidecar=True, the index is also read from / written to
+    the file path + SIDECAR_EXT, so that later runs skip parsing.
+    """
+    st = os.stat(path)
+    return _index_file(os.path.abspath(path), st.st_mtime_ns, st.st_size, sidecar)
+
+@functools.lru_cache(maxsize=4096)
+def _index_file(path, mtime_ns, size, sidecar):
+    sidecar_path = path + SIDECAR_EXT
+    if sidecar:
+        try:
+            index = JpegIndex.load(sidecar_path)
+            if index.size == size and index.mtime_ns == mtime_ns:
+                return index
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    if not size:
+        raise InvalidFileError("Not a JPEG file: the file is empty")
+    # the segment walk only touches the pages around the markers
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        index = JpegIndex.from_data(mapped, mtime_ns=mtime_ns)
+    if sidecar:
+        try:
+            index.save(sidecar_path)
+        except OSError:
+            pass
+    return index
 
 def main():
     global VERBOSE
@@ -123,8 +320,12 @@ def main():
 
     VERBOSE = args.verbose
 
-    with open(args.jpeg_file, 'rb') as f:
-        thermoblob = thermoblob_extr(f.read())
+    if VERBOSE:
+        # walk all segments to print the trace
+        with open(args.jpeg_file, "rb") as f:
+            thermoblob = thermoblob_extr(f.read())
+    else:
+        thermoblob = thermoblob_extr_file(args.jpeg_file)
 
     with open(args.output, "wb") as f:
         f.write(thermoblob)
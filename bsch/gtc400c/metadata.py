@@ -75,30 +75,148 @@ class ColorMap(enum.IntEnum):
   Iron = 2
   Greyscale = 3
 
+def compile_layout(fields):
+    """
+    Compile the fields table into a single little-endian struct.Struct,
+    skipping the gaps between the fields (including the matrix).
+    """
+    fmt, pos = "<", 0
+    for field in fields:
+        if field.address < pos:
+            raise ValueError(f"field {field.name} overlaps with the previous one")
+        if field.address > pos:
+            fmt += f"{field.address - pos}x"
+        fmt += field.format.lstrip("<")
+        pos = field.address + field.size
+    return struct.Struct(fmt)
+
+layout = compile_layout(fields)
+
+def _cstring(value):
+    return value.partition(b'\0')[0].decode('ascii')
+
+def _flags(value):
+    return [ds.name for ds in DisplaySetting if value & ds]
+
+# post-processing of the raw values by field name:
+converters = {
+  "metadata_v": tuple,
+  "firmware_v": tuple,
+  "model": _cstring,
+  "device_date_code": _cstring,
+  "material": Material,
+  "color_map": ColorMap,
+  "display_settings": _flags,
+}
+
+def _decoder(field):
+    if field.precision:
+        precision = field.precision
+        return lambda value: round(value, precision)
+    return converters.get(field.name)
+
+decoders = [(field, _decoder(field)) for field in fields]
+
 def metadata_extr(thermoblob):
 
-    for field in fields:
-        value = struct.unpack(field.format, thermoblob[field.address:field.address+field.size])
-        if len(value) == 1:
-            value = value[0]
-        if field.name in ("metadata_v", "firmware_v"):
-            value = tuple(value)
-        if field.precision:
-            value = round(value, field.precision)
-        if field.name == "material":
-            value = Material(value)
-        if field.name in ("model", "device_date_code"):
-            value = value.partition(b'\0')[0].decode('ascii')
-        if field.name == "color_map":
-            value = ColorMap(value)
-        if field.name == "display_settings":
-            flags = []
-            for ds in DisplaySetting:
-                if value & ds:
-                    flags.append(ds.name)
-            value = flags
+    values = layout.unpack_from(thermoblob)
+    for (field, decode), value in zip(decoders, values):
+        if decode is not None:
+            value = decode(value)
         yield field, value
 
+# per field: (Field, struct.Struct, decoder) for the lazy access by name
+field_decoders = {
+    field.name: (field, struct.Struct("<" + field.format.lstrip("<")), decode)
+    for field, decode in decoders
+}
+
+class Metadata:
+    """
+    The metadata of a thermoblob as record with one slot per field.
+    Each field is decoded on first access and cached. Iterating yields
+    (Field, value) tuples in the order of the fields table, just like
+    metadata_extr().
+    """
+
+    __slots__ = ("_thermoblob",) + tuple(field.name for field in fields)
+
+    def __init__(self, thermoblob):
+        self._thermoblob = thermoblob
+
+    def __getattr__(self, name):
+        # only called if the slot is not filled yet
+        try:
+            field, fmt, decode = field_decoders[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        value = fmt.unpack_from(self._thermoblob, field.address)[0]
+        if decode is not None:
+            value = decode(value)
+        setattr(self, name, value)
+        return value
+
+    def __getitem__(self, key):
+        if key not in field_decoders:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        for field in fields:
+            yield field, getattr(self, field.name)
+
+    def __len__(self):
+        return len(fields)
+
+    def __repr__(self):
+        return f"<Metadata: {', '.join(f'{f.name}={v!r}' for f, v in self)}>"
+
+def _np_format(field):
+    fmt = field.format.lstrip("<")
+    if fmt.endswith("s"):
+        if converters.get(field.name) is tuple:
+            return ("u1", (field.size,))
+        return f"S{field.size}"
+    return "<" + {"B": "u1", "H": "u2", "h": "i2", "I": "u4", "f": "f4"}[fmt]
+
+def metadata_dtype(itemsize=None, packed=False):
+    """
+    NumPy structured dtype matching the fields table, with the field
+    offsets taken from Field.address. The itemsize defaults to the size
+    of the layout, i.e. the thermoblob size. With packed=True, the
+    fields are stored back to back instead (e.g. for metadata tables).
+    """
+    import numpy as np
+    if packed:
+        return np.dtype([(field.name, _np_format(field)) for field in fields])
+    return np.dtype({
+        "names": [field.name for field in fields],
+        "formats": [_np_format(field) for field in fields],
+        "offsets": [field.address for field in fields],
+        "itemsize": itemsize or layout.size,
+    })
+
+def metadata_array(thermoblobs, itemsize=None):
+    """
+    Decode the metadata of many thermoblobs at once into a NumPy structured
+    array, e.g. result["epsilon"] for the emissivities of all images.
+
+    thermoblobs is either a sequence of equally sized thermoblobs or a
+    single bytes-like object with thermoblobs of itemsize bytes each,
+    stored back to back. The values are the raw ones: no rounding, enums
+    and display_settings as plain integers, strings as null-padded bytes.
+    """
+    import numpy as np
+    if not isinstance(thermoblobs, (bytes, bytearray, memoryview)):
+        thermoblobs = list(thermoblobs)
+        if not thermoblobs:
+            return np.empty(0, dtype=metadata_dtype(itemsize))
+        itemsize = itemsize or len(thermoblobs[0])
+        if any(len(thermoblob) != itemsize for thermoblob in thermoblobs):
+            raise ValueError("all thermoblobs need to have the same size")
+        thermoblobs = b"".join(thermoblobs)
+    return np.frombuffer(thermoblobs, dtype=metadata_dtype(itemsize))
+
 def main():
     import argparse
     
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Download images from the GTC 400 C and render them while later files
+are still downloading. Downloads are handed over in memory through a
+bounded queue to a pool of worker processes; when the workers fall
+behind, the queue fills up and the download pauses, which keeps the
+memory use bounded.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+from .ftp import FTP, close_quietly
+from . import batch
+
+def pipeline(command, folder, options=None, jobs=None, queue_size=8, keep_jpeg=True, force=False, connect=FTP, verbose=True):
+    """
+    Download all images from the device and process them with command
+    (see batch.process()) into folder. Images whose output exists are
+    skipped unless force is set. At most queue_size downloaded images
+    wait for a worker and 2 * jobs are being processed.
+    Returns the number of (processed, skipped, failed) images.
+    """
+    options = options or {}
+    jobs = jobs or os.cpu_count() or 1
+    downloads = queue.Queue(maxsize=queue_size)
+    download_error = []
+    skipped = 0
+
+    def downloader():
+        nonlocal skipped
+        try:
+            session = connect()
+            try:
+                for file in session.list_files():
+                    output = batch.output_path(command, os.path.join(folder, file.name))
+                    if not force and os.path.exists(output):
+                        skipped += 1
+                        continue
+                    downloads.put((file, output, session.download(file).getvalue()))
+            finally:
+                close_quietly(session)
+        except Exception as e:
+            download_error.append(e)
+        finally:
+            downloads.put(None)
+
+    start = time.monotonic()
+    processed = failed = 0
+
+    def report(futures):
+        nonlocal processed, failed
+        for future in futures:
+            name = in_flight.pop(future)
+            try:
+                output = future.result()
+            except Exception as e:
+                failed += 1
+                if verbose: print(f"{name} - failed: {e}")
+                continue
+            processed += 1
+            if verbose: print(f"{name} - {output}")
+
+    thread = threading.Thread(target=downloader, daemon=True)
+    thread.start()
+    in_flight = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            item = downloads.get()
+            if item is None:
+                break
+            file, output, jpeg_data = item
+            if keep_jpeg:
+                jpeg_path = os.path.join(folder, file.name)
+                with open(jpeg_path + ".part", "wb") as f:
+                    f.write(jpeg_data)
+                os.replace(jpeg_path + ".part", jpeg_path)
+            future = pool.submit(batch.process, command, jpeg_data, output, options, name=file.name)
+            in_flight[future] = file.name
+            if len(in_flight) >= 2 * jobs:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                report(done)
+        report(list(in_flight))
+    thread.join()
+
+    duration = time.monotonic() - start
+    if verbose:
+        print(f"{processed} processed, {skipped} skipped, {failed} failed in {duration:.1f} s")
+    if download_error:
+        raise download_error[0]
+    return processed, skipped, failed
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--folder", default=".", help="Target folder for the images and outputs.")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of worker processes, all CPUs by default.")
+    parser.add_argument("--queue-size", type=int, default=8, help="Maximum number of downloaded images waiting for a worker.")
+    parser.add_argument("--no-jpeg", action="store_true", help="Don't keep the downloaded JPEG files.")
+    parser.add_argument("--force", action="store_true", help="Process images even if their output exists.")
+    parser.add_argument("--cmap", metavar="CMAP_NAME", help="Colormap to use. By default, the one stored in each JPEG is used.")
+    batch.add_blend_arguments(parser, help_prefix="blend: ")
+    parser.add_argument("command", choices=("thermogram", "blend", "thermoblob"))
+    args = parser.parse_args()
+
+    options = {
+        "cmap": args.cmap, "scale": args.scale, "shift": args.shift, "opacity": args.opacity,
+        "sat": args.sat, "auto_register": args.auto_register,
+    }
+    processed, skipped, failed = pipeline(
+        args.command, args.folder, options, jobs=args.jobs, queue_size=args.queue_size,
+        keep_jpeg=not args.no_jpeg, force=args.force,
+    )
+    if failed:
+        parser.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Re-evaluate the temperatures of thermograms for a different emissivity
+and / or reflected temperature than the ones set on the device.
+
+The measured radiation is modeled as
+
+    S = ε · W(T_obj) + (1 - ε) · W(T_refl)
+
+with W(T) = T⁴ (Stefan-Boltzmann, T in K) as approximation of the
+radiance in the band of the detector. The device computed its matrix
+from S with its own ε and T_refl, so S can be recovered and solved for
+the object temperature with the new parameters.
+
+As the raw matrix values are 16 bit integers, the mapping is computed
+once for all 65536 possible values into a lookup table and applied to
+a frame or a whole (N, 120, 160) stack with a single take().
+"""
+
+import functools
+
+KELVIN = 273.15
+
+def _radiance(t):
+    return (t + KELVIN) ** 4
+
+@functools.lru_cache(maxsize=64)
+def radiometric_lut(epsilon, reflected_t, new_epsilon, new_reflected_t, dtype="float32"):
+    """
+    Lookup table (65536 entries) mapping raw matrix values recorded with
+    epsilon / reflected_t (deg C) to temperatures (deg C) for new_epsilon /
+    new_reflected_t. Values without physical solution are NaN.
+    """
+    import numpy as np
+    if not 0.0 < new_epsilon <= 1.0:
+        raise ValueError("the emissivity needs to be in the range (0, 1]")
+    t = (np.arange(65536, dtype=np.float64) - 10000) / 100
+    signal = epsilon * _radiance(t) + (1 - epsilon) * _radiance(reflected_t)
+    w_obj = (signal - (1 - new_epsilon) * _radiance(new_reflected_t)) / new_epsilon
+    with np.errstate(invalid="ignore"):
+        lut = (np.sqrt(np.sqrt(w_obj)) - KELVIN).astype(dtype)
+    lut.flags.writeable = False
+    return lut
+
+def recompute(raw, epsilon, reflected_t, new_epsilon=None, new_reflected_t=None, dtype="float32"):
+    """
+    Recompute the temperatures (deg C) of the raw matrix values in raw,
+    a single (120, 160) frame or a stack of N frames.
+
+    epsilon / reflected_t are the values used by the device, scalars or
+    arrays of length N for stacks. new_epsilon / new_reflected_t default
+    to the device values.
+    """
+    import numpy as np
+    raw = np.asarray(raw)
+    epsilon = np.round(np.asarray(epsilon, dtype=np.float64), 2)
+    reflected_t = np.round(np.asarray(reflected_t, dtype=np.float64), 2)
+
+    def lut_for(eps, refl):
+        return radiometric_lut(
+            float(eps), float(refl),
+            float(eps if new_epsilon is None else new_epsilon),
+            float(refl if new_reflected_t is None else new_reflected_t),
+            dtype=np.dtype(dtype).str,
+        )
+
+    if epsilon.ndim == 0 and reflected_t.ndim == 0:
+        return lut_for(epsilon, reflected_t).take(raw)
+
+    # stack with per frame parameters: one take() per distinct combination
+    epsilon, reflected_t = np.broadcast_arrays(epsilon, reflected_t)
+    out = np.empty(raw.shape, dtype=dtype)
+    params = np.stack([epsilon, reflected_t], axis=1)
+    combinations, inverse = np.unique(params, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    for i, (eps, refl) in enumerate(combinations):
+        selection = np.flatnonzero(inverse == i)
+        out[selection] = lut_for(eps, refl).take(raw[selection])
+    return out
+
+def recompute_thermography(t, new_epsilon=None, new_reflected_t=None, dtype="float32"):
+    """ Recompute the matrix of a Thermography, see recompute() """
+    return recompute(t.get_matrix_raw(), t.get("epsilon"), t.get("reflected_t"),
+                     new_epsilon, new_reflected_t, dtype=dtype)
+
+def recompute_stack(stack, new_epsilon=None, new_reflected_t=None, dtype="float32"):
+    """ Recompute all frames of a ThermographyStack, see recompute() """
+    return recompute(stack.frames, stack.metadata["epsilon"], stack.metadata["reflected_t"],
+                     new_epsilon, new_reflected_t, dtype=dtype)
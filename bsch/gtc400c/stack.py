@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Image sequences of the GTC 400 C as one memory-mapped (N, 120, 160)
+uint16 array on disk plus a table with the metadata of each frame.
+"""
+
+import os
+
+from .jpeg import thermoblob_extr_file
+from .metadata import metadata_array, metadata_dtype
+from .fusion import N_ROWS, N_COLS
+
+FRAMES_FILE = "frames.npy"
+METADATA_FILE = "metadata.npy"
+
+def raw_to_celsius(raw, dtype="float32"):
+    """ Scale raw matrix values (centi-degrees + 10000) of any shape to deg C """
+    import numpy as np
+    out = np.subtract(raw, 10000, dtype=dtype, casting="unsafe")
+    np.divide(out, 100, out=out)
+    return out
+
+class ThermographyStack:
+    """
+    A stack of N thermograms stored in a directory as two .npy files:
+    the raw frames (memory-mapped) and a metadata table with one row
+    per frame (NumPy structured array, see metadata.metadata_dtype()),
+    e.g. stack.metadata["epsilon"].
+    """
+
+    def __init__(self, directory, mode="r"):
+        import numpy as np
+        self.directory = directory
+        self.frames = np.load(os.path.join(directory, FRAMES_FILE), mmap_mode=mode)
+        self.metadata = np.load(os.path.join(directory, METADATA_FILE))
+
+    @classmethod
+    def create(cls, directory, jpeg_files, verbose=False):
+        """ Ingest the JPEG files (paths or binary file objects) into a new stack in directory """
+        import numpy as np
+        jpeg_files = list(jpeg_files)
+        os.makedirs(directory, exist_ok=True)
+        frames = np.lib.format.open_memmap(
+            os.path.join(directory, FRAMES_FILE), mode="w+",
+            dtype="<u2", shape=(len(jpeg_files), N_ROWS, N_COLS),
+        )
+        metadata = np.empty(len(jpeg_files), dtype=metadata_dtype(packed=True))
+        for i, jpeg_file in enumerate(jpeg_files):
+            thermoblob = thermoblob_extr_file(jpeg_file)
+            frames[i] = np.frombuffer(thermoblob, dtype="<u2", count=N_ROWS*N_COLS, offset=0x20).reshape((N_ROWS, N_COLS))
+            # fields are assigned by position from the thermoblob layout:
+            metadata[i] = metadata_array([thermoblob])[0]
+            if verbose: print(f"{i+1}/{len(jpeg_files)} {getattr(jpeg_file, 'name', jpeg_file)}")
+        frames.flush()
+        del frames
+        np.save(os.path.join(directory, METADATA_FILE), metadata)
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, key):
+        """ Raw frames (views into the memory map) """
+        return self.frames[key]
+
+    def __repr__(self):
+        return f"<ThermographyStack: {len(self)} frames in {self.directory}>"
+
+    def temperatures(self, key=slice(None), dtype="float32"):
+        """ The selected frames in deg C """
+        return raw_to_celsius(self.frames[key], dtype=dtype)
+
+    def pixel_series(self, row, col, dtype="float64"):
+        """ The temperature of a pixel (or a region given by slices) over all frames """
+        return raw_to_celsius(self.frames[:, row, col], dtype=dtype)
+
+    def frame_stats(self, chunk_size=256):
+        """
+        Per frame min, max, mean and standard deviation in deg C as
+        structured array. Works through the stack in chunks to bound the memory use.
+        """
+        import numpy as np
+        n = len(self)
+        stats = np.empty(n, dtype=[("min", "f8"), ("max", "f8"), ("mean", "f8"), ("std", "f8")])
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            raw = self.frames[start:stop].reshape((stop - start, -1))
+            stats["min"][start:stop] = raw_to_celsius(raw.min(axis=1), dtype="f8")
+            stats["max"][start:stop] = raw_to_celsius(raw.max(axis=1), dtype="f8")
+            temps = raw_to_celsius(raw, dtype="f8")
+            stats["mean"][start:stop] = temps.mean(axis=1)
+            stats["std"][start:stop] = temps.std(axis=1)
+        return stats
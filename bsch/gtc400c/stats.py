@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+Statistics of regions of interest (ROIs) over many thermograms:
+min, max, mean, standard deviation, percentiles and the positions of
+the hot and cold spots, computed for all frames and ROIs at once.
+
+The ROI masks are computed once and the frames are processed in chunks,
+so that the statistics of large (memory-mapped) stacks can be computed.
+"""
+
+import collections
+
+from .fusion import N_ROWS, N_COLS
+from .aggregate import raw_frame
+
+# A rectangle covering the pixel columns x0 .. x1-1 and rows y0 .. y1-1
+Rect = collections.namedtuple("Rect", ("name", "x0", "y0", "x1", "y1"))
+# A polygon with vertices [(x, y), ...] in pixel coordinates, pixels are
+# selected by their center
+Polygon = collections.namedtuple("Polygon", ("name", "points"))
+
+FULL_FRAME = Rect("frame", 0, 0, N_COLS, N_ROWS)
+CENTER_SPOT = Rect("center", N_COLS // 2 - 1, N_ROWS // 2 - 1, N_COLS // 2 + 1, N_ROWS // 2 + 1)
+
+def roi_mask(roi):
+    """ Boolean (120, 160) mask of the pixels in the ROI """
+    import numpy as np
+    if isinstance(roi, Rect):
+        mask = np.zeros((N_ROWS, N_COLS), dtype=bool)
+        mask[roi.y0:roi.y1, roi.x0:roi.x1] = True
+        return mask
+    # even-odd rule, evaluated for all pixel centers at once per edge
+    y, x = np.mgrid[0:N_ROWS, 0:N_COLS] + 0.5
+    points = np.asarray(roi.points, dtype=np.float64)
+    mask = np.zeros((N_ROWS, N_COLS), dtype=bool)
+    for (xa, ya), (xb, yb) in zip(points, np.roll(points, -1, axis=0)):
+        if ya == yb:
+            continue
+        crosses = (ya > y) != (yb > y)
+        x_intersect = xa + (y - ya) * (xb - xa) / (yb - ya)
+        mask ^= crosses & (x < x_intersect)
+    return mask
+
+def iter_chunks(images, chunk_size=1024):
+    """
+    Yield the raw (k, 120, 160) uint16 frames of images in chunks of up to
+    chunk_size frames. images is an array of frames, a ThermographyStack
+    or an iterable of Thermography objects (or thermoblobs), which is
+    read one chunk at a time into a reused buffer.
+    """
+    import numpy as np
+    if hasattr(images, "frames"):
+        images = images.frames
+    if isinstance(images, np.ndarray):
+        frames = images.reshape((-1, N_ROWS, N_COLS))
+        for start in range(0, len(frames), chunk_size):
+            yield np.asarray(frames[start:start+chunk_size])
+        return
+    buffer = np.empty((chunk_size, N_ROWS, N_COLS), dtype=np.uint16)
+    fill = 0
+    for item in images:
+        buffer[fill] = raw_frame(item)
+        fill += 1
+        if fill == chunk_size:
+            yield buffer
+            fill = 0
+    if fill:
+        yield buffer[:fill]
+
+def stats_dtype(percentiles=(5, 50, 95)):
+    import numpy as np
+    return np.dtype(
+        [("frame", "i8"), ("roi", "i2"), ("count", "i8"),
+         ("min", "f8"), ("max", "f8"), ("mean", "f8"), ("std", "f8")]
+        + [(f"p{p:g}", "f8") for p in percentiles]
+        + [("hot_row", "i2"), ("hot_col", "i2"), ("cold_row", "i2"), ("cold_col", "i2")]
+    )
+
+def roi_stats(images, rois=(FULL_FRAME,), percentiles=(5, 50, 95), chunk_size=1024):
+    """
+    Compute the statistics (deg C) of all ROIs for all images, see
+    iter_chunks() for the accepted inputs. Returns (result, names): a
+    structured array with one row per frame and ROI (frame-major), whose
+    "roi" field indexes the list of ROI names.
+    """
+    import numpy as np
+    n_rois = len(rois)
+    indices = [np.flatnonzero(roi_mask(roi)) for roi in rois]
+    if any(len(idx) == 0 for idx in indices):
+        raise ValueError("empty ROI")
+    dtype = stats_dtype(percentiles)
+
+    parts, n_frames = [], 0
+    for frames in iter_chunks(images, chunk_size):
+        n = len(frames)
+        flat = frames.reshape((n, -1))
+        rows = np.arange(n)
+        part = np.empty((n, n_rois), dtype=dtype)
+        part["frame"] = np.arange(n_frames, n_frames + n)[:, None]
+        part["roi"] = np.arange(n_rois)
+        part["count"] = [len(idx) for idx in indices]
+        for j, idx in enumerate(indices):
+            values = flat[:, idx]
+            rec = part[:, j]
+            # all statistics are computed on the raw values and scaled afterwards
+            hot, cold = values.argmax(axis=1), values.argmin(axis=1)
+            rec["max"] = (values[rows, hot] - 10000.0) / 100
+            rec["min"] = (values[rows, cold] - 10000.0) / 100
+            rec["hot_row"], rec["hot_col"] = np.divmod(idx[hot], N_COLS)
+            rec["cold_row"], rec["cold_col"] = np.divmod(idx[cold], N_COLS)
+            rec["mean"] = (values.mean(axis=1) - 10000) / 100
+            rec["std"] = values.std(axis=1) / 100
+            if percentiles:
+                for p, row in zip(percentiles, np.percentile(values, percentiles, axis=1)):
+                    rec[f"p{p:g}"] = (row - 10000) / 100
+        parts.append(part)
+        n_frames += n
+    result = np.concatenate(parts) if parts else np.empty((0, n_rois), dtype=dtype)
+    return result.reshape(-1), [roi.name for roi in rois]
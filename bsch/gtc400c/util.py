@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
-import argparse, io, os
+import argparse, functools, math, os
 
-from .jpeg import thermoblob_extr
-from .metadata import metadata_extr
+# Only light-weight modules are imported here, matplotlib, PIL and numpy
+# as well as the colormap definitions are imported where they are used,
+# so that e.g. `--help` of the tools starts quickly.
 from .fusion import Thermography
-from . import colormaps
 
 def get_cmap(name):
     """
@@ -16,6 +16,7 @@ def get_cmap(name):
 
     Raises ValueError if not found.
     """
+    from . import colormaps
     try:
         return colormaps.get_cmap(name)
     except ValueError:
@@ -27,113 +28,177 @@ def remove_ext(filename, ext=".JPG"):
         return filename[:-len(ext)]
     return filename
 
-def cli_thermogram():
-    from matplotlib import pyplot as plt
+def render_thermogram(t: Thermography, output, title="", cmap=None, fig=None):
+    """
+    Save a thermography plot with colorbar of t to output.
+    Pass the figure returned by a previous call as fig to reuse it.
+    """
+    from matplotlib.figure import Figure
     from mpl_toolkits.axes_grid1 import make_axes_locatable
+    from . import colormaps
+
+    if cmap is None:
+        cmap = colormaps.get_cmap(t.get("color_map").name)
+
+    if fig is None:
+        fig = Figure(figsize=(8, 6), dpi=96)
+    else:
+        fig.clf()
+    ax = fig.gca()
+    matrix = t.get_matrix()
+    fig.suptitle(title, size=16)
+    if hasattr(matrix, "min"):
+        low, high = matrix.min(), matrix.max()
+    else:
+        low, high = min(map(min, matrix)), max(map(max, matrix))
+    ax.set_title(f"min: {low:.2f}  max: {high:.2f}", size=10)
+    im = ax.imshow(matrix, extent=(0, 160, 0, 120), cmap=cmap)
+    ax_divider = make_axes_locatable(ax)
+    cax = ax_divider.append_axes("right", size="4%", pad="2%")
+    cbar = fig.colorbar(im, cax=cax)
+    fig.tight_layout()
+    cbar.set_label(t.unit, labelpad=-1)
+    fig.savefig(output)
+    return fig
 
+def cmap_help():
+    from . import colormaps
+    return f"Colormap to use. By default, the one stored in the JPEG is used. You can choose from the GTC colormaps {', '.join(colormaps.colormaps())}. As an ALTERNATIVE, select one of matplotlib's colormaps by name."
+
+def cli_thermogram():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--cmap", type=get_cmap, metavar="CMAP_NAME", help=f"Colormap to use. By default, the one stored in the JPEG is used. You can choose from the GTC colormaps {', '.join(colormaps.colormaps())}. As an ALTERNATIVE, select one of matplotlib's colormaps: {', '.join(plt.colormaps())}")
+    parser.add_argument("--cmap", metavar="CMAP_NAME", help=cmap_help())
     parser.add_argument("--output", help="Output filename. By default, it will be derived from the jpeg_file.")
     parser.add_argument("jpeg_file", type=argparse.FileType("rb"))
     args = parser.parse_args()
     if args.output is None and args.jpeg_file.name:
         args.output = remove_ext(args.jpeg_file.name) + ".thermogram.png"
-
-    t = Thermography(args.jpeg_file.read())
-
-    if args.cmap is None:
-        args.cmap = colormaps.get_cmap(t.get("color_map").name)
-
-    fig = plt.figure(figsize=(8, 6), dpi=96)
-    ax = plt.gca()
-    matrix = t.get_matrix_lst()
-    plt.suptitle(os.path.basename(args.jpeg_file.name), size=16)
-    plt.title(f"min: {min(map(min, matrix)):.2f}  max: {max(map(max, matrix)):.2f}", size=10)
-    im = ax.imshow(matrix, extent=(0, 160, 0, 120), cmap=args.cmap)
-    ax_divider = make_axes_locatable(ax)
-    cax = ax_divider.append_axes("right", size="4%", pad="2%")
-    cbar = fig.colorbar(im, cax=cax)
-    plt.tight_layout()
-    cbar.set_label(t.unit, labelpad=-1)
-    plt.savefig(args.output)
+    if args.cmap is not None:
+        # resolved after parsing, as it might need matplotlib
+        try:
+            args.cmap = get_cmap(args.cmap)
+        except ValueError as e:
+            parser.error(f"argument --cmap: {e}")
+
+    t = Thermography(args.jpeg_file)
+    render_thermogram(t, args.output, title=os.path.basename(args.jpeg_file.name), cmap=args.cmap)
     print(args.output)
 
 def cli_plot():
-    from matplotlib import pyplot as plt
-
     parser = argparse.ArgumentParser()
     parser.add_argument("jpeg_file", type=argparse.FileType("rb"))
     args = parser.parse_args()
 
-    t = Thermography(args.jpeg_file.read())
+    from matplotlib import pyplot as plt
+    from . import colormaps
+
+    t = Thermography(args.jpeg_file)
     cmap = colormaps.get_cmap(t.get("color_map").name)
 
-    plt.imshow(t.get_matrix_lst(), cmap=cmap)
+    plt.imshow(t.get_matrix(), cmap=cmap)
     plt.colorbar()
     plt.show()
 
-def blend_real_and_ir(t: Thermography, scale=3.25, shift=(8, 6), opacity=0.80, sat=0.4, cmap=None):
-    """ blend the real and the ir images together """
+def get_lut(cmap, N=256):
+    """
+    Return an (N, 3) uint8 lookup table for the colormap given by name
+    or as matplotlib colormap. matplotlib is only imported for colormaps
+    not defined in bsch.gtc400c.colormaps.
+    """
+    from . import colormaps
+    name = cmap if isinstance(cmap, str) else getattr(cmap, "name", None)
+    if name in colormaps.colormaps():
+        return colormaps.get_lut(name, N)
+    import numpy as np
+    if isinstance(cmap, str):
+        cmap = get_cmap(cmap)
+    return cmap(np.linspace(0.0, 1.0, N), bytes=True)[:, :3]
+
+def registration(t: Thermography):
+    """
+    The registration of the IR image on the real image as stored by the
+    device: (scale, (shift_x, shift_y), flip_x, flip_y)
+    """
+    return t.get("vis_scale_up"), (t.get("vis_shift_x"), t.get("vis_shift_y")), bool(t.get("vis_flip_x")), bool(t.get("vis_flip_y"))
+
+@functools.lru_cache(maxsize=64)
+def ir_transform(real_size, scale, shift, flip_x=False, flip_y=False, ir_size=(160, 120)):
+    """
+    Coefficients of the affine transform for PIL's Image.transform()
+    mapping pixel coordinates of the real image to the IR image, which is
+    scaled up by scale, centered on the real image, shifted by shift and
+    optionally flipped. Cached per device configuration.
+    """
+    if not (math.isfinite(scale) and scale > 0):
+        raise ValueError(f"the scale of the IR image needs to be a positive number, not {scale}")
+    coeffs = []
+    for real, ir, offset, flip in zip(real_size, ir_size, shift, (flip_x, flip_y)):
+        origin = (real - ir * scale) / 2 + offset
+        factor, constant = 1 / scale, -origin / scale
+        if flip:
+            factor, constant = -factor, ir - constant
+        coeffs.append((factor, constant))
+    (a, c), (e, f) = coeffs
+    return (a, 0.0, c, 0.0, e, f)
+
+def blend_real_and_ir(t: Thermography, scale=3.25, shift=(8, 6), opacity=0.80, sat=0.4, cmap=None, auto_register=False):
+    """
+    blend the real and the ir images together
+
+    With auto_register=True, scale, shift and flipping are taken from the
+    metadata of the image (see registration()) instead of the arguments.
+    If the stored scale isn't a positive number, the arguments are used.
+    """
 
-    from matplotlib import pyplot as plt
     from PIL import Image, ImageEnhance
+    from . import colormaps
 
     if cmap is None:
         # use the one embedded in the JPEG:
-        cmap = colormaps.get_cmap(t.get("color_map").name)
-    elif type(cmap) == str:
-        cmap = get_cmap(cmap)
-
-    matrix = t.get_matrix_lst()
-
-    fig, ax = plt.subplots(figsize=(scale*4, scale*3), dpi=40, frameon=False)
-    ax = fig.add_axes([0, 0, 1, 1])
-    ax.axis('off')
-    ax.imshow(matrix, cmap=cmap)
-    fig.patch.set_visible(False)
-    #plt.colorbar()
+        cmap = t.get("color_map").name
 
-    #thermo = Image.frombytes('RGB', fig.canvas.get_width_height(), fig.canvas.tostring_rgb())
-    # or...
-    tmp = io.BytesIO()
-    fig.canvas.print_png(tmp)
-    tmp.seek(0)
-    thermo = Image.open(tmp)
+    flip_x = flip_y = False
+    if auto_register:
+        registered = registration(t)
+        if math.isfinite(registered[0]) and registered[0] > 0:
+            scale, shift, flip_x, flip_y = registered
 
-    blend = t.get_real_im().copy()
+    blend = t.get_real_im().convert("RGB")
 
     if sat != 1.0:
         converter = ImageEnhance.Color(blend)
         blend = converter.enhance(sat)
 
-    ts, rs = thermo.size, blend.size
-    offset = (rs[0] - ts[0]) // 2, (rs[1] - ts[1]) // 2
-    offset = offset[0] + shift[0], offset[1] + shift[1]
-
     # remap opacity from range 0.0 = transparent, 1.0 = opaque  to:  0x00 = transparent, 0xff = opaque
     opacity = int(round(opacity * 255))
-    thermo.putalpha(opacity)
-    blend.putalpha(0xff)
-    blend.paste(thermo, offset, thermo)
 
-    return blend
+    # colorize the matrix and map it onto the real image in a single resampling pass
+    rgba = colormaps.apply_lut(get_lut(cmap), t.get_matrix_np(dtype="float32"), alpha=opacity)
+    coeffs = ir_transform(blend.size, float(scale), tuple(shift), flip_x, flip_y)
+    thermo = Image.fromarray(rgba, "RGBA").transform(blend.size, Image.AFFINE, coeffs, resample=Image.NEAREST, fillcolor=(0, 0, 0, 0))
+
+    blend.putalpha(0xff)
+    return Image.alpha_composite(blend, thermo)
 
 def cli_blend():
-    from matplotlib import pyplot as plt
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--scale", type=float, default=3.25, help="Scale the IR image up by this factor.")
     parser.add_argument("--shift", type=lambda x: tuple(int(e) for e in x.split(",")), default=(8, 6), help="Shift the IR image w.r.t. the real image by this amount of pixels.")
     parser.add_argument("--opacity", type=float, default=0.667, help="Opacity of the IR thermography overlay, range: 0.0 - 1.0.")
     parser.add_argument("--sat", type=float, default=0.4, help="Saturation of the real image, range: 0.0 - 1.0.")
-    parser.add_argument("--cmap", type=get_cmap, metavar="CMAP_NAME", help=f"Colormap to use. By default, the one stored in the JPEG is used. You can choose from the GTC colormaps {', '.join(colormaps.colormaps())}. As an ALTERNATIVE, select one of matplotlib's colormaps: {', '.join(plt.colormaps())}")
+    parser.add_argument("--auto-register", action="store_true", help="Take scale, shift and flipping of the IR image from the metadata of the JPEG instead of --scale / --shift.")
+    parser.add_argument("--cmap", metavar="CMAP_NAME", help=cmap_help())
     parser.add_argument("--output", help="Output filename. If None, it will be derived from the jpeg_file.")
     parser.add_argument("jpeg_file", type=argparse.FileType("rb"))
     args = parser.parse_args()
     if not args.output:
-        output = remove_ext(args.jpeg_file.name) + ".blend.png"
-    t = Thermography(args.jpeg_file.read())
-    if args.cmap is None:
-        args.cmap = colormaps.get_cmap(t.get("color_map").name)
-    blend = blend_real_and_ir(t, scale=args.scale, shift=args.shift, opacity=args.opacity, sat=args.sat, cmap=args.cmap)
-    blend.save(output)
-    print(output)
+        args.output = remove_ext(args.jpeg_file.name) + ".blend.png"
+    if args.cmap is not None:
+        try:
+            get_lut(args.cmap)
+        except ValueError as e:
+            parser.error(f"argument --cmap: {e}")
+    t = Thermography(args.jpeg_file)
+    blend = blend_real_and_ir(t, scale=args.scale, shift=args.shift, opacity=args.opacity, sat=args.sat, cmap=args.cmap, auto_register=args.auto_register)
+    blend.save(args.output)
+    print(args.output)
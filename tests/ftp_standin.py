@@ -0,0 +1,158 @@
+"""
+A minimal FTP server behaving like the GTC 400 C as far as the clients
+in bsch.gtc400c use it: the IMAGE folder, LIST, RETR and REST (or the
+device's "202 Command not implemented" reply to it), a limit on the
+number of simultaneous connections and optionally a control connection
+that is dropped in the middle of a transfer.
+
+    server = DeviceStandin({"IMG_0001.JPG": data})
+    session = server.client()
+    ...
+    server.close()
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+from bsch.gtc400c import ftp
+
+NOT_IMPLEMENTED = "202 Command not implemented, superfluous at this site."
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        self.wfile.write(line.encode("latin-1") + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            if server.active >= server.max_connections:
+                self.send("421 Too many connections.")
+                return
+            server.active += 1
+            server.stats["max_active"] = max(server.stats["max_active"], server.active)
+        try:
+            self.session()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def session(self):
+        server = self.server
+        self.send("220 GTC400C")
+        pasv = None
+        rest = 0
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                cmd, _, arg = line.decode("latin-1").strip().partition(" ")
+                cmd = cmd.upper()
+                if cmd == "USER":
+                    self.send("331 Password required.")
+                elif cmd == "PASS":
+                    self.send("230 Logged in.")
+                elif cmd in ("CWD", "TYPE"):
+                    self.send("200 OK.")
+                elif cmd == "PASV":
+                    if pasv is not None:
+                        pasv.close()
+                    pasv = socket.socket()
+                    pasv.bind(("127.0.0.1", 0))
+                    pasv.listen(1)
+                    port = pasv.getsockname()[1]
+                    self.send(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF}).")
+                elif cmd == "REST" and server.rest:
+                    rest = int(arg)
+                    with server.lock:
+                        server.stats["rest"].append(rest)
+                    self.send(f"350 Restarting at {rest}.")
+                elif cmd == "LIST":
+                    self.send("150 Opening data connection.")
+                    conn, _ = pasv.accept()
+                    with conn:
+                        for name, data in sorted(server.files.items()):
+                            conn.sendall(f"-rw-rw-rw- 1 user group {len(data)} Jan 1 12:00 {name}\r\n".encode("latin-1"))
+                    pasv.close()
+                    pasv = None
+                    self.send("226 Transfer complete.")
+                elif cmd == "RETR":
+                    name = arg.rpartition("/")[2]
+                    if name not in server.files:
+                        self.send("550 File not found.")
+                        continue
+                    data = server.files[name][rest:]
+                    rest = 0
+                    with server.lock:
+                        server.stats["retr"] += 1
+                        drop = server.drops > 0
+                        if drop:
+                            server.drops -= 1
+                    self.send("150 Opening data connection.")
+                    conn, _ = pasv.accept()
+                    pasv.close()
+                    pasv = None
+                    with conn:
+                        try:
+                            for pos in range(0, len(data), 4096):
+                                if drop and pos >= len(data) // 2:
+                                    # the device went away mid-transfer
+                                    return
+                                conn.sendall(data[pos:pos+4096])
+                                with server.lock:
+                                    server.stats["bytes"] += len(data[pos:pos+4096])
+                                time.sleep(server.delay)
+                        except OSError:
+                            # closed early by the client
+                            self.send("426 Transfer aborted.")
+                            continue
+                    self.send("226 Transfer complete.")
+                elif cmd == "QUIT":
+                    self.send("221 Goodbye.")
+                    return
+                else:
+                    self.send(NOT_IMPLEMENTED)
+        finally:
+            if pasv is not None:
+                pasv.close()
+
+class DeviceStandin(socketserver.ThreadingTCPServer):
+    """
+    Serves files (name -> bytes) on a free port of 127.0.0.1. With
+    rest=False REST is answered like the device without resume support,
+    drops is the number of RETRs during which the control connection is
+    closed half way through the file.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, files, max_connections=4, rest=True, drops=0, delay=0.0005):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.files = files
+        self.max_connections = max_connections
+        self.rest = rest
+        self.drops = drops
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats = {"retr": 0, "bytes": 0, "rest": [], "max_active": 0}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def client(self):
+        """ A bsch.gtc400c.ftp.FTP session connected to the stand-in """
+        class StandinFTP(ftp.FTP):
+            port = self.port
+        return StandinFTP("127.0.0.1", timeout=5)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
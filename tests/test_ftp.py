@@ -0,0 +1,188 @@
+"""
+Checks of the FTP download pool against a stand-in for the device, run with
+
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from bsch.gtc400c import ftp
+from bsch.gtc400c.ftp_async import AsyncFTP
+from bsch.gtc400c.jpeg import InvalidFileError
+
+from ftp_standin import DeviceStandin
+
+def image_files(count=6, size=100007):
+    rng = random.Random(count)
+    return {f"IMG_{i:04d}.JPG": bytes(rng.getrandbits(8) for _ in range(size)) for i in range(count)}
+
+class DownloadFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def serve(self, files, **kwargs):
+        server = DeviceStandin(files, **kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    def download(self, server, connections):
+        with server.client() as session:
+            listed = session.list_files()
+        return ftp.download_files(listed, self.folder.name, connections=connections,
+                                  connect=server.client, verbose=False)
+
+    def assertDownloaded(self, files):
+        self.assertEqual(sorted(os.listdir(self.folder.name)), sorted(files))
+        for name, data in files.items():
+            with open(os.path.join(self.folder.name, name), "rb") as f:
+                self.assertEqual(f.read(), data, name)
+
+    def test_pool(self):
+        files = image_files()
+        server = self.serve(files)
+        count, size, _ = self.download(server, connections=3)
+        self.assertEqual((count, size), (len(files), sum(map(len, files.values()))))
+        self.assertEqual(server.stats["max_active"], 3)
+        self.assertDownloaded(files)
+
+    def test_connection_limit(self):
+        # the connections beyond the device's limit are refused with 421
+        files = image_files()
+        server = self.serve(files, max_connections=2)
+        count, _, _ = self.download(server, connections=5)
+        self.assertEqual(count, len(files))
+        self.assertEqual(server.stats["max_active"], 2)
+        self.assertDownloaded(files)
+
+    def test_resume(self):
+        files = image_files(count=1)
+        (name, data), = files.items()
+        with open(os.path.join(self.folder.name, name + ".part"), "wb") as f:
+            f.write(data[:40000])
+        server = self.serve(files)
+        _, size, _ = self.download(server, connections=1)
+        self.assertEqual(size, len(data) - 40000)
+        self.assertEqual(server.stats["rest"], [40000])
+        self.assertDownloaded(files)
+
+    def test_resume_unsupported(self):
+        files = image_files(count=1)
+        (name, data), = files.items()
+        with open(os.path.join(self.folder.name, name + ".part"), "wb") as f:
+            f.write(b"\0" * 40000)
+        server = self.serve(files, rest=False)
+        _, size, _ = self.download(server, connections=1)
+        self.assertEqual(size, len(data))
+        self.assertDownloaded(files)
+
+    def test_dropped_connection(self):
+        # a dropped session is replaced and the file resumed
+        files = image_files()
+        server = self.serve(files, drops=2)
+        count, _, _ = self.download(server, connections=2)
+        self.assertEqual(count, len(files))
+        self.assertEqual(len(server.stats["rest"]), 2)
+        self.assertDownloaded(files)
+
+    def test_dropped_connection_gives_up(self):
+        files = image_files(count=2)
+        server = self.serve(files, drops=100)
+        with self.assertRaises(ftp.ftplib.Error):
+            self.download(server, connections=1)
+
+    def flaky_connect(self, server, working=1, delay=0.0):
+        """ connect() opening working sessions, later calls fail after delay like a busy device """
+        calls = []
+        def connect():
+            calls.append(None)
+            if len(calls) > working:
+                time.sleep(delay)
+                raise ftp.ftplib.error_temp("421 Too many connections.")
+            return server.client()
+        return connect
+
+    def test_failing_connection(self):
+        # the files are left to the working session
+        files = image_files(count=2)
+        server = self.serve(files)
+        with server.client() as session:
+            listed = session.list_files()
+        count, _, _ = ftp.download_files(listed, self.folder.name, connections=2,
+                                         connect=self.flaky_connect(server, delay=1.0), verbose=False)
+        self.assertEqual(count, len(files))
+        self.assertDownloaded(files)
+
+    def test_failing_reconnect(self):
+        # the worker losing its connection can't reconnect, the other one
+        # takes over the file
+        files = image_files(count=2)
+        server = self.serve(files, drops=1)
+        with server.client() as session:
+            listed = session.list_files()
+        count, _, _ = ftp.download_files(listed, self.folder.name, connections=2,
+                                         connect=self.flaky_connect(server, working=2, delay=1.0), verbose=False)
+        self.assertEqual(count, len(files))
+        self.assertDownloaded(files)
+
+    def test_missing_file(self):
+        files = image_files(count=2)
+        server = self.serve(files)
+        with server.client() as session:
+            listed = session.list_files()
+        del files[listed[0].name]
+        with self.assertRaisesRegex(ftp.ftplib.Error, "1 files"):
+            ftp.download_files(listed, self.folder.name, connections=1, connect=server.client, verbose=False)
+        self.assertDownloaded(files)
+
+def jpeg(thermoblob, scan_size=100000):
+    """ A JFIF file with the thermoblob in an APPF segment and random scan data """
+    rng = random.Random(scan_size)
+    scan = bytes(rng.getrandbits(8) for _ in range(scan_size)).replace(b"\xFF", b"\xFF\x00")
+    return (b"\xFF\xD8" + b"\xFF\xE0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+            + b"\xFF\xEF" + (len(thermoblob) + 2).to_bytes(2, "big") + thermoblob
+            + b"\xFF\xDA\x00\x02" + scan + b"\xFF\xD9")
+
+class ReadThermoblobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.thermoblob = bytes(range(256)) * 4
+        self.server = DeviceStandin({"BAD.JPG": b"no JPEG at all" * 1000, "GOOD.JPG": jpeg(self.thermoblob)})
+        self.addCleanup(self.server.close)
+
+    def test_partial_read(self):
+        with self.server.client() as session:
+            thermoblob, received = session.read_thermoblob("GOOD.JPG")
+        self.assertEqual(thermoblob, self.thermoblob)
+        self.assertLess(received, 100000)
+
+    def test_invalid_file(self):
+        # the session stays usable after a file without thermoblob
+        with self.server.client() as session:
+            with self.assertRaises(InvalidFileError):
+                session.read_thermoblob("BAD.JPG")
+            self.assertEqual(session.read_thermoblob("GOOD.JPG")[0], self.thermoblob)
+            skipped = []
+            self.assertEqual(list(session.thermographies(["BAD.JPG"], on_invalid=lambda *args: skipped.append(args))), [])
+            self.assertEqual(skipped[0][0], "BAD.JPG")
+
+    def test_async(self):
+        async def read():
+            async with AsyncFTP("127.0.0.1", port=self.server.port) as session:
+                with self.assertRaises(ftp.ftplib.error_perm):
+                    await session.read_thermoblob("MISSING.JPG")
+                with self.assertRaises(InvalidFileError):
+                    await session.read_thermoblob("BAD.JPG")
+                return await session.read_thermoblob("GOOD.JPG")
+        thermoblob, received = asyncio.run(read())
+        self.assertEqual(thermoblob, self.thermoblob)
+        self.assertLess(received, 100000)
+
+if __name__ == "__main__":
+    unittest.main()